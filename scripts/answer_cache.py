@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class AnswerCache:
+    # Двухуровневый кэш ответов:
+    # 1) точное совпадение нормализованного вопроса;
+    # 2) почти такой же вопрос — по косинусной близости embedding запроса.
+    # LRU по числу записей + TTL, полный сброс при смене версии индекса.
+    # scope — фильтр поиска (роль, модуль): близкие вопросы с разными фильтрами
+    # не подменяют ответы друг друга.
+
+    def __init__(self, max_entries=1024, ttl=3600, similarity=0.95, version_fn=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._version_fn = version_fn
+        self._version = version_fn() if version_fn else None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (answer, unit vector, created_at, scope)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def _check_version(self):
+        if self._version_fn is None:
+            return
+        version = self._version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self.invalidations += 1
+
+    def _expired(self, created_at, now):
+        return self.ttl and now - created_at > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[2], time.time()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_similar(self, vector, scope=None):
+        vector = _unit(vector)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            best_key, best_score = None, self.similarity
+            for key, (_, cached, created_at, entry_scope) in list(self._entries.items()):
+                if self._expired(created_at, now):
+                    del self._entries[key]
+                    continue
+                if entry_scope != scope:
+                    continue
+                score = float(np.dot(cached, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            return self._entries[best_key][0]
+
+    def put(self, key, vector, answer, scope=None, version=None):
+        # version — версия индекса, по которой построен ответ. Ответ, который дописался
+        # после переключения на новый индекс, в кэш не попадает
+        with self._lock:
+            self._check_version()
+            if version is not None and self._version_fn is not None and version != self._version:
+                self.stale_puts += 1
+                return
+            self._entries[key] = (answer, _unit(vector), time.time(), scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from doc_metadata import normalize_label
+from md_chunker import parse_sections
+
+logger = logging.getLogger("uniguide.answers")
+
+ANSWER_STORE_FILE = "answers.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    question TEXT PRIMARY KEY,
+    module_id TEXT,
+    roles TEXT,
+    doc_hash TEXT,
+    origin TEXT,
+    answer TEXT,
+    sources TEXT,
+    index_version TEXT,
+    created_at REAL,
+    vector BLOB
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def canonical_questions(meta, text):
+    # Типовые вопросы по модулю из названия и секций документа json_to_md
+    title = meta.get("title")
+    if not title:
+        return []
+    _, sections = parse_sections(text)
+    names = {name for name, _ in sections}
+    questions = [f"Что такое «{title}»?"]
+    if "Шаги" in names:
+        questions.append(f"Как выполнить «{title}» в UNIVER?")
+    if "Подсказки интерфейса" in names:
+        questions.append(f"Где в интерфейсе найти «{title}»?")
+    return questions
+
+
+def open_store(path):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.executescript(_SCHEMA)
+    return db
+
+
+class AnswerStore:
+    # Заранее сгенерированные ответы на типовые вопросы (scripts/build_answer_store.py).
+    # Вопрос пользователя сравнивается с ними по косинусной близости embedding'ов;
+    # если совпадение выше similarity, ответ отдаётся без поиска и без LLM.
+    # Файл перечитывается, если его пересобрали (проверка не чаще раза в reload_interval с).
+    # Файла может ещё не быть — хранилище подхватит его после сборки.
+    # version_fn — версия загруженного индекса: хранилище, собранное по другому индексу,
+    # не используется, пока его не пересоберут.
+
+    def __init__(self, path, similarity=0.92, embedding_model=None, reload_interval=30, version_fn=None):
+        self.path = path
+        self.similarity = similarity
+        self.embedding_model = embedding_model
+        self.reload_interval = reload_interval
+        self.version_fn = version_fn
+        self._stale_warned = None
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._entries = []
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.reloads = 0
+        self._load()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        db = sqlite3.connect(self.path)
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+            rows = db.execute(
+                "SELECT question, module_id, roles, answer, sources, vector FROM answers"
+            ).fetchall()
+        finally:
+            db.close()
+        if self.embedding_model and meta.get("embedding_model") != self.embedding_model:
+            # Вектора другой модели сравнивать с запросами нельзя
+            logger.warning("Хранилище ответов %s собрано моделью %s, а не %s — не используется",
+                           self.path, meta.get("embedding_model"), self.embedding_model)
+            rows = []
+        entries = [
+            {
+                "question": question,
+                "module_id": module_id,
+                "roles": json.loads(roles),
+                "answer": answer,
+                "sources": json.loads(sources),
+            }
+            for question, module_id, roles, answer, sources, _ in rows
+        ]
+        vectors = np.stack([np.frombuffer(row[5], dtype=np.float32) for row in rows]) if rows else \
+            np.empty((0, 0), dtype=np.float32)
+        with self._lock:
+            self._entries, self._vectors = entries, vectors
+            self.index_version = meta.get("index_version")
+            if self._mtime is not None:
+                self.reloads += 1
+            self._mtime = mtime
+        logger.info("Хранилище ответов: %d вопросов (индекс %s)", len(entries), self.index_version)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            self._load()
+        except sqlite3.Error as e:
+            logger.warning("Не удалось перечитать хранилище ответов: %s", e)
+
+    def _stale(self):
+        # Хранилище собрано по другой версии индекса, чем загружена в сервер
+        if self.version_fn is None or self.index_version is None:
+            return False
+        current = self.version_fn()
+        if current is None or current == self.index_version:
+            return False
+        if self._stale_warned != (self.index_version, current):
+            self._stale_warned = (self.index_version, current)
+            logger.warning("Хранилище ответов собрано по индексу %s, загружен %s — не используется "
+                           "до пересборки build_answer_store.py", self.index_version, current)
+        return True
+
+    def _visible(self, entry, role, module):
+        if role and entry["roles"] and normalize_label(role) not in entry["roles"]:
+            return False
+        if module and normalize_label(module) != normalize_label(entry["module_id"] or ""):
+            return False
+        return True
+
+    def match(self, vector, role=None, module=None):
+        # Готовый ответ для вопроса или None
+        self._maybe_reload()
+        with self._lock:
+            entries, vectors = self._entries, self._vectors
+        if not entries:
+            return None
+        if self._stale():
+            with self._lock:
+                self.stale += 1
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        scores = vectors @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < self.similarity:
+                break
+            if self._visible(entries[i], role, module):
+                with self._lock:
+                    self.hits += 1
+                return entries[i]["answer"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "questions": len(self._entries),
+                "index_version": self.index_version,
+                "similarity": self.similarity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "reloads": self.reloads,
+            }
@@ -1,14 +1,55 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain.chains.retrieval_qa.base import RetrievalQA
-from langchain_community.llms import Ollama
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from pydantic import BaseModel, Field
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from answer_cache import AnswerCache
+from answer_store import ANSWER_STORE_FILE, AnswerStore
+from context_builder import ContextAssembler
+from doc_metadata import MetadataIndex
+from extractive import ExtractiveAnswerer
+from embed_batcher import MicroBatchEmbeddings
+from index_store import IndexWatcher, index_version, load_vectorstore, resolve_index_path
+from lexical_index import BM25Index
+from lifecycle import NotReadyError, Startup, memory_usage
+from metrics import RequestMetrics, Trace
+from normalize import normalize_query
+from ollama_pool import NoBackendError, OllamaBackend, OllamaPool
+from query_embed_cache import cached_embeddings
+from rag_pipeline import RagPipeline, cache_key, filter_scope
+from reranker import Reranker
+from sessions import SESSION_ID_PATTERN, SessionStore
+from singleflight import SingleFlight
+from streaming import pool_stream, sse_event
+from token_count import DEFAULT_LLM_TOKENIZER, approx_tokens, llm_token_counter
+from worker_pool import QueueFullError, WorkerPool
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("uniguide.api")
+
+# Пул для быстрых блокирующих этапов: embedding, поиск FAISS, хранилище ответов,
+# быстрые ответы по шагам модуля. Размер пула и длина очереди настраиваются
+pool = WorkerPool(
+    max_workers=int(os.environ.get("UNIGUIDE_WORKERS", "4")),
+    max_queue=int(os.environ.get("UNIGUIDE_QUEUE_SIZE", "16")),
+)
+# Генерации Ollama идут в своём пуле: поток занят всю генерацию, и быстрые этапы
+# других запросов не ждут его в общей очереди
+llm_pool = WorkerPool(
+    max_workers=int(os.environ.get("UNIGUIDE_LLM_CONCURRENCY", "2")),
+    max_queue=int(os.environ.get("UNIGUIDE_LLM_QUEUE_SIZE", "16")),
+    name="llm-worker",
+)
 
 # FastAPI init
 app = FastAPI()
@@ -23,35 +64,508 @@ app.add_middleware(
 # Input schema
 class Question(BaseModel):
     question: str
+    # Необязательные фильтры поиска: роль пользователя и модуль (ID или doc_id)
+    role: Optional[str] = None
+    module: Optional[str] = None
+    # extractive — шаги модуля без LLM, generative — генерация, auto — шаги, если поиск уверен
+    mode: Optional[Literal["extractive", "generative", "auto"]] = None
+    # Диалог: вопросы с одним session_id видят историю (в пакетах не используется)
+    session_id: Optional[str] = Field(None, pattern=SESSION_ID_PATTERN)
+
+
+# Пакет вопросов: stream=true — результаты строками NDJSON по мере готовности
+class BatchQuestions(BaseModel):
+    questions: List[Question]
+    stream: bool = False
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LLM_MODEL = "mistral:Q4_K_M"
+# Серверы Ollama через запятую; запрос уходит на наименее загруженный
+OLLAMA_URLS = os.environ.get("UNIGUIDE_OLLAMA_URLS", "http://localhost:11434")
+# Сколько держать модель в памяти Ollama после запроса (-1 — всегда)
+OLLAMA_KEEP_ALIVE = os.environ.get("UNIGUIDE_OLLAMA_KEEP_ALIVE", "-1")
+INDEX_PATH = os.environ.get("UNIGUIDE_INDEX_PATH", "/home/django/uniguide-bot/faiss_index")
+# Режим для нескольких воркеров uvicorn: индекс отображается в память, а не копируется
+INDEX_MMAP = os.environ.get("UNIGUIDE_INDEX_MMAP", "0") == "1"
+WARMUP_QUESTION = "Как изменить пароль в системе?"
+
+# Гибридный поиск (BM25 + FAISS), если рядом с индексом есть lexical.pkl
+HYBRID = os.environ.get("UNIGUIDE_HYBRID", "1") == "1"
+FETCH_K = int(os.environ.get("UNIGUIDE_FETCH_K", "10"))
+# Переранжирование кандидатов перед LLM (по умолчанию выключено)
+RERANK = os.environ.get("UNIGUIDE_RERANK", "0") == "1"
+RERANK_MODEL = os.environ.get("UNIGUIDE_RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.environ.get("UNIGUIDE_RERANK_CANDIDATES", "8"))
+# Сколько чанков брать в контекст и бюджет контекста в токенах LLM
+TOP_K = int(os.environ.get("UNIGUIDE_TOP_K", "2"))
+CONTEXT_TOKENS = int(os.environ.get("UNIGUIDE_CONTEXT_TOKENS", "800"))
+LLM_TOKENIZER = os.environ.get("UNIGUIDE_LLM_TOKENIZER", DEFAULT_LLM_TOKENIZER)
+# Заранее сгенерированные ответы (scripts/build_answer_store.py) и порог совпадения вопроса
+ANSWER_STORE = os.environ.get("UNIGUIDE_ANSWER_STORE", os.path.join(INDEX_PATH, ANSWER_STORE_FILE))
+STORE_SIMILARITY = float(os.environ.get("UNIGUIDE_STORE_SIMILARITY", "0.92"))
+# Режим ответа по умолчанию и минимальный отрыв лучшего модуля для быстрого ответа
+ANSWER_MODE = os.environ.get("UNIGUIDE_ANSWER_MODE", "auto")
+EXTRACTIVE_MARGIN = float(os.environ.get("UNIGUIDE_EXTRACTIVE_MARGIN", "0.15"))
+DOC_LINK_BASE = os.environ.get("UNIGUIDE_DOC_LINK_BASE", "")
+# Пакетные запросы: максимум вопросов и одновременных генераций на пакет
+BATCH_MAX = int(os.environ.get("UNIGUIDE_BATCH_MAX", "64"))
+BATCH_CONCURRENCY = int(os.environ.get("UNIGUIDE_BATCH_CONCURRENCY", str(llm_pool.max_workers)))
+# Сессии диалога: память под все сессии, время жизни без запросов, бюджет истории в prompt
+SESSION_MEMORY_MB = float(os.environ.get("UNIGUIDE_SESSION_MEMORY_MB", "16"))
+SESSION_IDLE = float(os.environ.get("UNIGUIDE_SESSION_IDLE", "1800"))
+HISTORY_TOKENS = int(os.environ.get("UNIGUIDE_HISTORY_TOKENS", "300"))
+# Как часто проверять, не опубликована ли новая версия индекса (0 — не проверять)
+INDEX_POLL = float(os.environ.get("UNIGUIDE_INDEX_POLL", "10"))
 
-# Prompt system
-system_prompt = """
-Ты — интеллектуальный помощник пользователей системы UNIVER.
-Отвечай только на русском языке. Отвечай кратко, чётко и по делу.
-Используй только приведённый ниже контекст. Не выдумывай.
-Обязательно используй термины, встречающиеся в вопросе.
-"""
-
-prompt_template = PromptTemplate(
-    input_variables=["context", "question"],
-    template=system_prompt + "\n\nКонтекст:\n{context}\n\nВопрос: {question}\nОтвет:"
+# Тяжёлые компоненты создаются в фазе запуска, а не при импорте модуля
+startup = Startup()
+batcher = None
+embedding = None
+db = None
+llm = None
+lexical = None
+metadata = None
+extractive = None
+reranker = None
+assembler = None
+store = None
+pipeline = None
+loaded_version = None
+watcher = None
+
+# Кэш ответов сбрасывается, как только сервер переключился на новый индекс
+cache = AnswerCache(
+    max_entries=int(os.environ.get("UNIGUIDE_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("UNIGUIDE_CACHE_TTL", "3600")),
+    similarity=float(os.environ.get("UNIGUIDE_CACHE_SIMILARITY", "0.95")),
+    version_fn=lambda: loaded_version,
+)
+
+# История диалогов; токены считаются токенизатором LLM, когда он загружен
+sessions = SessionStore(
+    max_bytes=int(SESSION_MEMORY_MB * 1024 * 1024),
+    idle_ttl=SESSION_IDLE,
+    history_tokens=HISTORY_TOKENS,
 )
 
-# Инициализация компонентов цепочки
-embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-db = FAISS.load_local("/home/django/uniguide-bot/faiss_index", embedding, allow_dangerous_deserialization=True)
-retriever = db.as_retriever(search_kwargs={"k": 2})
-llm = Ollama(model="mistral:Q4_K_M", temperature=0)
 
-llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-combine_chain = StuffDocumentsChain(llm_chain=llm_chain, document_variable_name="context")
-qa = RetrievalQA(combine_documents_chain=combine_chain, retriever=retriever)
+def load_resources():
+    global batcher, embedding, db, lexical, metadata, extractive, reranker, assembler, store, llm, pipeline, loaded_version, watcher
+
+    with startup.phase("imports"):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    with startup.phase("embedding_model"):
+        # Запросы из разных потоков пула кодируются пачками (генерации идут в llm_pool,
+        # поэтому потоки пула свободны для embedding'а), повторные вопросы берутся из кэша
+        batcher = MicroBatchEmbeddings(
+            HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+            max_batch=int(os.environ.get("UNIGUIDE_EMBED_BATCH", "16")),
+            max_wait=float(os.environ.get("UNIGUIDE_EMBED_WAIT_MS", "0")) / 1000,
+        )
+        embedding = cached_embeddings(batcher, namespace=EMBEDDING_MODEL)
+
+    with startup.phase("faiss_index"):
+        version = index_version(INDEX_PATH)
+        db, lexical, metadata, extractive = open_index(resolve_index_path(INDEX_PATH))
+    logger.info("Индекс %s, память воркера: %s", version, memory_usage())
+
+    with startup.phase("answer_store"):
+        # Без файла хранилище пустое и подхватит его, когда build_answer_store.py его соберёт
+        store = AnswerStore(ANSWER_STORE, similarity=STORE_SIMILARITY, embedding_model=EMBEDDING_MODEL,
+                            version_fn=lambda: loaded_version)
+
+    with startup.phase("tokenizer"):
+        # Размер контекста считается токенами самой LLM
+        count_tokens = llm_token_counter(LLM_TOKENIZER)
+        if count_tokens is approx_tokens:
+            startup.warn(f"Токенизатор {LLM_TOKENIZER} не загружен: бюджет контекста и истории "
+                         f"считается оценкой по символам")
+        assembler = ContextAssembler(count_tokens, token_budget=CONTEXT_TOKENS)
+        sessions.count_tokens = count_tokens
+
+    if RERANK:
+        with startup.phase("reranker"):
+            reranker = Reranker(
+                model_name=RERANK_MODEL or None,
+                token_budget=CONTEXT_TOKENS,
+                time_budget=float(os.environ.get("UNIGUIDE_RERANK_BUDGET_MS", "150")) / 1000,
+                lemmatizer=lexical.lemmatizer if lexical is not None else None,
+                count_tokens=count_tokens,
+            )
+
+    with startup.phase("llm_client"):
+        keep_alive = int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE
+        llm = OllamaPool(
+            [
+                OllamaBackend(
+                    url.strip(), LLM_MODEL, options={"temperature": 0}, keep_alive=keep_alive,
+                    max_connections=llm_pool.max_workers,
+                    failure_threshold=int(os.environ.get("UNIGUIDE_OLLAMA_FAILURES", "3")),
+                    cooldown=float(os.environ.get("UNIGUIDE_OLLAMA_COOLDOWN", "30")),
+                )
+                for url in OLLAMA_URLS.split(",") if url.strip()
+            ],
+            health_interval=float(os.environ.get("UNIGUIDE_OLLAMA_HEALTH_INTERVAL", "10")),
+        )
+        llm.start()
+
+    pipeline = make_pipeline(db, lexical, metadata, extractive, version)
+    loaded_version = version
+
+    if INDEX_POLL > 0:
+        watcher = IndexWatcher(INDEX_PATH, version, reload_index, interval=INDEX_POLL)
+        watcher.start()
+
+
+def open_index(path):
+    new_db = load_vectorstore(path, embedding, mmap=INDEX_MMAP)
+    new_lexical = BM25Index.load(path) if HYBRID else None
+    # metadata_index.json есть у индексов, собранных с метаданными ролей и модулей
+    new_metadata = MetadataIndex.load(path)
+    # modules.json — шаги и подсказки модулей для ответов без LLM
+    new_extractive = ExtractiveAnswerer.load(path, margin=EXTRACTIVE_MARGIN, link_base=DOC_LINK_BASE)
+    return new_db, new_lexical, new_metadata, new_extractive
+
+
+def make_pipeline(new_db, new_lexical, new_metadata, new_extractive, version):
+    return RagPipeline(
+        new_db, llm, k=TOP_K, cache=cache, lexical=new_lexical, fetch_k=FETCH_K,
+        reranker=reranker, rerank_candidates=RERANK_CANDIDATES, metadata=new_metadata,
+        assembler=assembler, store=store, extractive=new_extractive, index_version=version,
+    )
+
+
+def reload_index(version, path):
+    # Новая версия загружается и проверяется в фоне, затем подменяется ссылка на pipeline.
+    # Запросы в полёте дорабатывают со старым индексом.
+    global db, lexical, metadata, extractive, pipeline, loaded_version
+
+    started = time.perf_counter()
+    new_db, new_lexical, new_metadata, new_extractive = open_index(path)
+    new_pipeline = make_pipeline(new_db, new_lexical, new_metadata, new_extractive, version)
+    new_pipeline.retrieve(WARMUP_QUESTION)
+    db, lexical, metadata, extractive, pipeline = new_db, new_lexical, new_metadata, new_extractive, new_pipeline
+    loaded_version = version
+    logger.info(
+        "✅ Индекс %s загружен за %.0f ms, память воркера: %s",
+        version, 1000 * (time.perf_counter() - started), memory_usage(),
+    )
+
+
+def warm_up():
+    # Синтетический запрос прогревает embedder, FAISS и модель в Ollama.
+    # Кэш ответов не задействуется.
+    with startup.phase("warmup_embedding"):
+        vector = pipeline.embed(WARMUP_QUESTION)
+    with startup.phase("warmup_search"):
+        docs = pipeline.retrieve(WARMUP_QUESTION, vector)
+    with startup.phase("warmup_llm"):
+        llm.invoke(pipeline.build_prompt(WARMUP_QUESTION, docs[:1]))
+
+
+@app.on_event("startup")
+def start_loading():
+    if os.environ.get("UNIGUIDE_WARMUP", "1") == "1":
+        startup.run_in_background(load_resources, warm_up)
+    else:
+        startup.run_in_background(load_resources, lambda: None)
+
+# Одинаковые одновременные вопросы разделяют одну генерацию
+flights = SingleFlight()
+
+# Метрики Prometheus (/metrics); очередь и пул опрашиваются в момент чтения
+metrics = RequestMetrics()
+metrics.registry.gauge("uniguide_queue_depth", "Задачи в очереди пула", fn=lambda: pool.stats()["queue_depth"])
+metrics.registry.gauge("uniguide_workers_busy", "Занятые потоки пула", fn=lambda: pool.stats()["running"])
+metrics.registry.gauge("uniguide_llm_queue_depth", "Генерации в очереди", fn=lambda: llm_pool.stats()["queue_depth"])
+metrics.registry.gauge("uniguide_llm_workers_busy", "Генерации в работе", fn=lambda: llm_pool.stats()["running"])
+metrics.registry.gauge("uniguide_singleflight_in_flight", "Генерации, которые ждут несколько запросов",
+                       fn=lambda: flights.stats()["in_flight"])
+metrics.registry.gauge("uniguide_ready", "Модели загружены и прогреты", fn=lambda: int(startup.status()["ready"]))
+metrics.registry.gauge("uniguide_startup_warnings", "Деградации запуска (например, нет токенизатора LLM)",
+                       fn=lambda: len(startup.warnings))
+metrics.registry.gauge("uniguide_sessions", "Активные сессии диалога", fn=lambda: sessions.stats()["sessions"])
+metrics.registry.gauge("uniguide_sessions_bytes", "Память под историю диалогов", fn=lambda: sessions.stats()["bytes"])
+metrics.registry.gauge("uniguide_llm_in_flight", "Запросы в работе на сервере Ollama", ("backend",),
+                       fn=lambda: {(b.url,): b.in_flight for b in llm.backends})
+metrics.registry.gauge("uniguide_llm_available", "Сервер Ollama доступен (breaker не разомкнут)", ("backend",),
+                       fn=lambda: {(b.url,): int(b.available) for b in llm.backends})
+
+
+def busy_response(e, trace):
+    logger.warning("%s: %s, генерации: %s", e, pool.stats(), llm_pool.stats())
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(e), "request_id": trace.request_id},
+        headers={"Retry-After": str(e.retry_after), **trace.headers()},
+    )
+
+
+async def single(answer):
+    yield answer
+
+
+def answer_stream(current, question, role, module, mode, trace, history):
+    # План (кэш, хранилище, быстрый ответ, поиск, prompt) — в пуле быстрых этапов,
+    # генерация — в llm_pool. Место в пуле занимается сразу: QueueFullError поднимается
+    # до создания полёта
+    planned = asyncio.wrap_future(pool.submit(current.plan, question, role, module, mode, trace, history))
+
+    async def tokens():
+        plan = await planned
+        if plan["answer"] is not None:
+            trace.source = plan["source"]
+            yield plan["answer"]
+            return
+        async for token in pool_stream(llm_pool, current.stream_plan, plan, trace, time.perf_counter()):
+            yield token
+
+    return tokens()
+
+
+def ask_tokens(question, role=None, module=None, mode=None, trace=None, session_id=None):
+    startup.check()
+    mode = mode or ANSWER_MODE
+    history = None
+    if session_id:
+        # Уточнение достраивается до самостоятельного запроса, история идёт в prompt
+        question, history = sessions.prepare(session_id, question)
+    if mode != "extractive":
+        # Точный кэш проверяется прямо в event loop: ответ из кэша не ждёт пула
+        cached = cache.get(cache_key(question, role, module))
+        if cached is not None:
+            trace.source = "cache"
+            return single(cached)
+        llm.ensure_available()
+    # Ответ с историей принадлежит своей сессии и с другими не разделяется
+    key = (normalize_query(question), filter_scope(role, module), mode, loaded_version,
+           session_id if history else None)
+    # Этапы пишутся в trace запроса, который запустил генерацию; присоединившиеся
+    # к ней запросы получают только общее время
+    current = pipeline
+    return flights.subscribe(
+        key, lambda: answer_stream(current, question, role, module, mode, trace, history)
+    )
+
 
 # Маршрут обработки
 @app.post("/ask")
-async def ask_question(q: Question):
+async def ask_question(q: Question, request: Request):
+    trace = metrics.start("ask", request.headers.get("x-request-id"))
+    try:
+        tokens = ask_tokens(q.question, q.role, q.module, q.mode, trace, q.session_id)
+        answer = "".join([token async for token in tokens])
+    except (QueueFullError, NotReadyError, NoBackendError) as e:
+        metrics.finish(trace, e)
+        return busy_response(e, trace)
+    except Exception as e:
+        metrics.finish(trace, e)
+        return JSONResponse({"error": str(e), "request_id": trace.request_id}, headers=trace.headers())
+    metrics.finish(trace)
+    if q.session_id:
+        sessions.add_turn(q.session_id, q.question, answer)
+    return JSONResponse({"answer": answer}, headers=trace.headers())
+
+
+# Потоковый ответ (SSE): токены Ollama отправляются по мере генерации
+@app.post("/ask/stream")
+async def ask_question_stream(q: Question, request: Request):
+    trace = metrics.start("ask_stream", request.headers.get("x-request-id"))
+    try:
+        tokens = ask_tokens(q.question, q.role, q.module, q.mode, trace, q.session_id)
+    except (QueueFullError, NotReadyError, NoBackendError) as e:
+        metrics.finish(trace, e)
+        return busy_response(e, trace)
+
+    async def events():
+        started = time.perf_counter()
+        ttft = None
+        error = None
+        parts = []
+        try:
+            async for token in tokens:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                parts.append(token)
+                yield sse_event("token", {"token": token})
+            total = time.perf_counter() - started
+            metrics.finish(trace)
+            # В историю попадает только полностью полученный ответ
+            if q.session_id:
+                sessions.add_turn(q.session_id, q.question, "".join(parts))
+            # Заголовки уже отправлены: замеры этапов приходят в последнем событии
+            yield sse_event("done", {
+                "ttft_ms": round(1000 * (ttft or total)),
+                "total_ms": round(1000 * total),
+                **trace.summary(),
+            })
+        except Exception as e:
+            error = e
+            yield sse_event("error", {"error": str(e), "request_id": trace.request_id})
+        finally:
+            # Клиент отключился посреди потока — запрос тоже закрывается
+            metrics.finish(trace, error)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-ID": trace.request_id},
+    )
+
+
+async def batch_results(current, plans):
+    # (номер вопроса, результат) по мере готовности: сначала ответы без LLM,
+    # затем генерации — не больше BATCH_CONCURRENCY одновременно, одинаковые вопросы один раз
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def generate(plan):
+        async with semaphore:
+            trace = Trace(endpoint="ask_batch")
+            try:
+                llm.ensure_available()
+                tokens = pool_stream(llm_pool, current.stream_plan, plan, trace, time.perf_counter())
+                answer = "".join([token async for token in tokens])
+            except Exception as e:
+                metrics.errors.inc(endpoint="ask_batch", type=type(e).__name__)
+                return plan, {"error": str(e)}
+            metrics.observe(trace)
+            return plan, {"answer": answer, "source": "llm"}
+
+    waiting = {}
+    for index, plan in enumerate(plans):
+        if plan["answer"] is not None:
+            metrics.batch_items.inc(source=plan["source"])
+            yield index, {"answer": plan["answer"], "source": plan["source"]}
+        else:
+            waiting.setdefault(id(plan), []).append(index)
+    tasks = [asyncio.create_task(generate(plans[indices[0]])) for indices in waiting.values()]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            plan, result = await finished
+            for index in waiting[id(plan)]:
+                metrics.batch_items.inc(source=result.get("source", "error"))
+                yield index, result
+    finally:
+        # Клиент ушёл — оставшиеся генерации не нужны
+        for task in tasks:
+            task.cancel()
+
+
+# Пакет вопросов: один проход embedding'а и один поиск FAISS на все вопросы
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuestions, request: Request):
+    trace = metrics.start("ask_batch", request.headers.get("x-request-id"))
+    if len(batch.questions) > BATCH_MAX:
+        error = ValueError(f"Слишком много вопросов: {len(batch.questions)}, максимум {BATCH_MAX}")
+        metrics.finish(trace, error)
+        return JSONResponse(status_code=413, content={"error": str(error), "request_id": trace.request_id},
+                            headers=trace.headers())
+    items = [(q.question, q.role, q.module, q.mode or ANSWER_MODE) for q in batch.questions]
     try:
-        result = qa.invoke({"query": q.question})
-        return {"answer": result["result"]}
+        startup.check()
+        current = pipeline
+        plans = await pool.run(current.plan_batch, items, trace)
+    except (QueueFullError, NotReadyError) as e:
+        metrics.finish(trace, e)
+        return busy_response(e, trace)
     except Exception as e:
-        return {"error": str(e)}
+        metrics.finish(trace, e)
+        return JSONResponse({"error": str(e), "request_id": trace.request_id}, headers=trace.headers())
+    trace.source = "batch"
+
+    if batch.stream:
+        async def lines():
+            errors = 0
+            try:
+                async for index, result in batch_results(current, plans):
+                    errors += "error" in result
+                    yield json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+                metrics.finish(trace)
+                yield json.dumps({"done": True, "count": len(plans), "errors": errors, **trace.summary()},
+                                 ensure_ascii=False) + "\n"
+            finally:
+                metrics.finish(trace)
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson",
+                                 headers={"X-Accel-Buffering": "no", "X-Request-ID": trace.request_id})
+
+    results = [None] * len(plans)
+    async for index, result in batch_results(current, plans):
+        results[index] = {"index": index, **result}
+    metrics.finish(trace)
+    return JSONResponse({"results": results, "request_id": trace.request_id}, headers=trace.headers())
+
+
+# Сессия диалога: размер и длина истории (без текста вопросов)
+@app.get("/sessions/{session_id}")
+async def session_info(session_id: str):
+    info = sessions.session_stats(session_id)
+    if info is None:
+        return JSONResponse(status_code=404, content={"error": "Сессия не найдена"})
+    return info
+
+
+# Начать диалог заново
+@app.delete("/sessions/{session_id}")
+async def session_reset(session_id: str):
+    return {"deleted": sessions.drop(session_id)}
+
+
+# Liveness: процесс жив и event loop отвечает
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+# Readiness: модели загружены и прогреты, можно направлять трафик
+@app.get("/readyz")
+async def readyz():
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+# Метрики в формате Prometheus
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Состояние очереди и пула
+@app.get("/stats")
+async def stats():
+    result = {
+        "startup": startup.status(),
+        "memory": memory_usage(),
+        "pool": pool.stats(),
+        "llm_pool": llm_pool.stats(),
+        "cache": cache.stats(),
+        "singleflight": flights.stats(),
+        "sessions": sessions.stats(),
+    }
+    if watcher is not None:
+        result["index"] = watcher.stats()
+    if metadata is not None:
+        result["metadata"] = metadata.stats()
+    if extractive is not None:
+        result["extractive"] = extractive.stats()
+    if store is not None:
+        result["answer_store"] = store.stats()
+    if assembler is not None:
+        result["context"] = assembler.stats()
+    if reranker is not None:
+        result["rerank"] = reranker.stats()
+    if batcher is not None:
+        result["embedding"] = batcher.stats()
+        result["embedding_cache"] = embedding.stats()
+    if llm is not None:
+        result["llm"] = llm.stats()
+    return result
+
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    pool.shutdown()
+    llm_pool.shutdown()
+    if llm is not None:
+        llm.close()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from context_builder import ContextAssembler
+from doc_metadata import MetadataIndex
+from index_store import index_version, load_vectorstore, resolve_index_path
+from lexical_index import BM25Index
+from ollama_pool import OllamaBackend, OllamaPool
+from rag_pipeline import RagPipeline
+from token_count import DEFAULT_LLM_TOKENIZER, llm_token_counter
+
+BENCH_QUESTIONS = [
+    "Где найти часто задаваемые вопросы по системе?",
+    "Как добавить вопрос в экзамен?",
+    "Кто может просматривать расписание группы?",
+    "Как отправить заявку на поступление?",
+    "Какие документы нужны для зачисления?",
+    "Как изменить пароль в системе?",
+    "Где можно скачать учебный план?",
+    "Куда обращаться при технических проблемах?",
+    "Можно ли редактировать загруженные файлы?",
+    "Как узнать результат экзамена?",
+]
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LLM_MODEL = "mistral:Q4_K_M"
+STAGES = ("embed", "retrieve", "prompt", "llm_ttft", "llm", "total")
+
+
+class FakeLLM:
+    # Детерминированная замена Ollama: ответ из первых слов контекста,
+    # prompt «обрабатывается» со скоростью prompt_rate, токены идут со скоростью token_rate.
+
+    def __init__(self, token_rate=20.0, answer_tokens=40, prompt_rate=0.0):
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.prompt_rate = prompt_rate
+
+    def stream(self, prompt, usage=None):
+        if self.prompt_rate:
+            time.sleep(len(prompt.split()) / self.prompt_rate)
+        context = prompt.split("Контекст:", 1)[-1].split()
+        for i in range(self.answer_tokens):
+            time.sleep(1.0 / self.token_rate)
+            yield (" " if i else "") + (context[i % len(context)] if context else "ответ")
+        if usage is not None:
+            usage["eval_count"] = self.answer_tokens
+
+    def invoke(self, prompt, usage=None):
+        return "".join(self.stream(prompt, usage))
+
+
+def summarize(samples):
+    # {этап: {p50, p95, p99, mean}} в миллисекундах
+    result = {}
+    for stage in STAGES:
+        values = np.asarray([s[stage] for s in samples if stage in s], dtype=np.float64) * 1000
+        if not len(values):
+            continue
+        result[stage] = {
+            "p50": round(float(np.percentile(values, 50)), 2),
+            "p95": round(float(np.percentile(values, 95)), 2),
+            "p99": round(float(np.percentile(values, 99)), 2),
+            "mean": round(float(values.mean()), 2),
+        }
+    return result
+
+
+def run_question(pipeline, llm, question):
+    timings = {}
+    started = time.perf_counter()
+    vector = pipeline.embed(question)
+    timings["embed"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    docs = pipeline.retrieve(question, vector)
+    timings["retrieve"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    prompt = pipeline.build_prompt(question, docs)
+    timings["prompt"] = time.perf_counter() - mark
+
+    if llm is not None:
+        mark = time.perf_counter()
+        for _ in llm.stream(prompt):
+            if "llm_ttft" not in timings:
+                timings["llm_ttft"] = time.perf_counter() - mark
+        timings["llm"] = time.perf_counter() - mark
+    timings["total"] = time.perf_counter() - started
+    return timings
+
+
+def run(args):
+    questions = BENCH_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = json.load(f)
+
+    load_ms = {}
+    started = time.perf_counter()
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    load_ms["embedding_model"] = round(1000 * (time.perf_counter() - started))
+
+    started = time.perf_counter()
+    path = resolve_index_path(args.index)
+    db = load_vectorstore(path, embedding, mmap=args.mmap)
+    lexical = BM25Index.load(path) if args.hybrid else None
+    load_ms["index"] = round(1000 * (time.perf_counter() - started))
+
+    if args.llm == "none":
+        llm = None
+    elif args.llm == "fake":
+        llm = FakeLLM(args.token_rate, args.answer_tokens, args.prompt_rate)
+    else:
+        urls = os.environ.get("UNIGUIDE_OLLAMA_URLS", "http://localhost:11434")
+        llm = OllamaPool([OllamaBackend(u.strip(), LLM_MODEL, options={"temperature": 0})
+                          for u in urls.split(",") if u.strip()])
+
+    assembler = None
+    if args.context_tokens:
+        assembler = ContextAssembler(
+            llm_token_counter(os.environ.get("UNIGUIDE_LLM_TOKENIZER", DEFAULT_LLM_TOKENIZER)),
+            token_budget=args.context_tokens,
+        )
+    # Без кэшей: замеряется сам конвейер
+    pipeline = RagPipeline(db, llm, k=args.k, lexical=lexical, metadata=MetadataIndex.load(path),
+                           assembler=assembler)
+
+    # Холодный прогон — первый проход по вопросам сразу после загрузки
+    print(f"🧊 Холодный прогон: {len(questions)} вопросов")
+    cold = [run_question(pipeline, llm, q) for q in questions]
+    warm = []
+    for i in range(args.runs):
+        print(f"🔥 Тёплый прогон {i + 1}/{args.runs}")
+        warm.extend(run_question(pipeline, llm, q) for q in questions)
+
+    result = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "index_version": index_version(args.index),
+            "llm": args.llm,
+            "token_rate": args.token_rate if args.llm == "fake" else None,
+            "questions": len(questions),
+            "warm_runs": args.runs,
+            "k": args.k,
+            "hybrid": lexical is not None,
+            "mmap": args.mmap,
+            "context_tokens": args.context_tokens,
+            "host": platform.node(),
+            "cpus": os.cpu_count(),
+        },
+        "load_ms": load_ms,
+        "cold": summarize(cold),
+        "warm": summarize(warm),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print_summary(result)
+    print(f"💾 Результаты: {args.output}")
+
+
+def print_summary(result):
+    for phase in ("cold", "warm"):
+        print(f"\n{phase:<6} {'этап':<10} {'p50':>10} {'p95':>10} {'p99':>10}")
+        for stage, stats in result[phase].items():
+            print(f"{'':<6} {stage:<10} {stats['p50']:>10.1f} {stats['p95']:>10.1f} {stats['p99']:>10.1f}")
+
+
+def compare(args):
+    # Регрессия — если метрика выросла больше чем на threshold и больше чем на min_ms
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    # Сравнение имеет смысл только при одинаковых условиях прогона
+    for key in ("llm", "token_rate", "questions", "k", "hybrid", "mmap", "context_tokens", "cpus"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"⚠️ Разные условия: {key} = {baseline['meta'].get(key)} / {current['meta'].get(key)}")
+
+    regressions = 0
+    print(f"{'фаза':<6} {'этап':<10} {'было':>10} {'стало':>10} {'изменение':>10}")
+    for phase in ("cold", "warm"):
+        for stage, stats in current.get(phase, {}).items():
+            before = baseline.get(phase, {}).get(stage, {}).get(args.stat)
+            if before is None:
+                continue
+            after = stats[args.stat]
+            change = (after - before) / before if before else 0.0
+            regressed = change > args.threshold and after - before > args.min_ms
+            regressions += regressed
+            mark = " ⚠️" if regressed else ""
+            print(f"{phase:<6} {stage:<10} {before:>10.1f} {after:>10.1f} {100 * change:>+9.1f}%{mark}")
+    if regressions:
+        print(f"\n❌ Регрессий ({args.stat}, порог {100 * args.threshold:.0f}%): {regressions}")
+        sys.exit(1)
+    print(f"\n✅ Регрессий нет ({args.stat}, порог {100 * args.threshold:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер конвейера RAG по этапам")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Прогнать вопросы и сохранить результаты в JSON")
+    run_parser.add_argument("--index", default="faiss_index", help="Каталог индекса")
+    run_parser.add_argument("--questions", help="JSON-список вопросов (по умолчанию встроенные 10)")
+    run_parser.add_argument("--runs", type=int, default=3, help="Сколько тёплых прогонов")
+    run_parser.add_argument("--llm", choices=("fake", "ollama", "none"), default="fake")
+    run_parser.add_argument("--token-rate", type=float, default=20.0, help="Токенов в секунду у fake LLM")
+    run_parser.add_argument("--answer-tokens", type=int, default=40, help="Длина ответа fake LLM")
+    run_parser.add_argument("--prompt-rate", type=float, default=0.0,
+                            help="Слов prompt в секунду у fake LLM (0 — без задержки)")
+    run_parser.add_argument("--k", type=int, default=2, help="Чанков в контексте")
+    run_parser.add_argument("--no-hybrid", dest="hybrid", action="store_false", help="Только FAISS")
+    run_parser.add_argument("--mmap", action="store_true", help="Индекс через mmap")
+    run_parser.add_argument("--context-tokens", type=int, default=800,
+                            help="Бюджет контекста в токенах (0 — склейка чанков целиком)")
+    run_parser.add_argument("--output", default="benchmark.json")
+
+    compare_parser = sub.add_parser("compare", help="Сравнить результаты с базовыми")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--stat", choices=("p50", "p95", "p99", "mean"), default="p95")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Допустимый рост (0.10 = 10%%)")
+    compare_parser.add_argument("--min-ms", type=float, default=1.0, help="Рост меньше этого не считается")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from answer_store import ANSWER_STORE_FILE, canonical_questions, open_store
+from context_builder import ContextAssembler
+from doc_metadata import MetadataIndex, access_labels, parse_doc_header
+from index_store import index_version, load_vectorstore, resolve_index_path
+from lexical_index import BM25Index
+from ollama_pool import OllamaBackend, OllamaPool
+from rag_pipeline import RagPipeline
+from token_count import DEFAULT_LLM_TOKENIZER, llm_token_counter
+
+DOCS_DIR = "data/rag_docs"
+INDEX_ROOT = "faiss_index"
+QUESTIONS_FILE = "data/canonical_questions.json"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LLM_MODEL = "mistral:Q4_K_M"
+
+# Ответ с такими фразами модель дала, не найдя ответа в контексте — в хранилище не пишем
+_REFUSALS = ("не знаю", "нет информации", "не содержит информации", "не указано в контексте")
+
+
+def vet_answer(answer):
+    text = answer.strip().lower()
+    return len(text) >= 20 and not any(phrase in text for phrase in _REFUSALS)
+
+
+def load_questions(docs_dir, questions_file):
+    # Типовые вопросы: выведенные из каждого модуля и из курируемого списка
+    # [{"question": ..., "module": ..., "answer": необязательный проверенный ответ}]
+    modules = {}
+    items = {}
+    for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.md"), recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        meta = parse_doc_header(text)
+        module_id = meta.get("module_id") or meta.get("doc_id")
+        if not module_id:
+            continue
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        modules[module_id] = (meta, digest)
+        for question in canonical_questions(meta, text):
+            items[question] = {"module_id": module_id, "roles": access_labels(meta),
+                               "doc_hash": digest, "origin": "auto", "answer": None}
+    if questions_file and os.path.exists(questions_file):
+        with open(questions_file, encoding="utf-8") as f:
+            curated = json.load(f)
+        for item in curated:
+            meta, digest = modules.get(item["module"], ({}, ""))
+            answer = item.get("answer")
+            # Изменение ручного ответа тоже должно пересобрать запись
+            digest = hashlib.sha256(f"{digest}\0{answer or ''}".encode("utf-8")).hexdigest()
+            items[item["question"]] = {"module_id": item["module"], "roles": access_labels(meta),
+                                       "doc_hash": digest, "origin": "curated", "answer": answer}
+    return items
+
+
+def make_llm():
+    urls = os.environ.get("UNIGUIDE_OLLAMA_URLS", "http://localhost:11434")
+    llm = OllamaPool([OllamaBackend(url.strip(), LLM_MODEL, options={"temperature": 0})
+                      for url in urls.split(",") if url.strip()])
+    llm.check()
+    return llm
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заранее сгенерированные ответы на типовые вопросы")
+    parser.add_argument("--full", action="store_true", help="Пересоздать все ответы")
+    parser.add_argument("--docs", default=DOCS_DIR, help="Каталог с markdown-документами")
+    parser.add_argument("--index", default=INDEX_ROOT, help="Каталог индекса")
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="Курируемый список вопросов (JSON)")
+    parser.add_argument("--store", default=None, help=f"Файл хранилища (по умолчанию <index>/{ANSWER_STORE_FILE})")
+    args = parser.parse_args()
+    store_path = args.store or os.path.join(args.index, ANSWER_STORE_FILE)
+
+    items = load_questions(args.docs, args.questions)
+    print(f"❓ Типовых вопросов: {len(items)}")
+
+    db = open_store(store_path)
+    meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+    full = args.full or meta.get("embedding_model") != EMBEDDING_MODEL
+    existing = {} if full else dict(db.execute("SELECT question, doc_hash FROM answers").fetchall())
+    todo = [q for q, item in items.items() if existing.get(q) != item["doc_hash"]]
+    removed = [q for q in existing if q not in items]
+    print(f"♻️ Без изменений: {len(items) - len(todo)}, сгенерировать: {len(todo)}, удалить: {len(removed)}")
+    if full:
+        db.execute("DELETE FROM answers")
+    db.executemany("DELETE FROM answers WHERE question = ?", [(q,) for q in removed])
+
+    version = index_version(args.index)
+    if todo:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        path = resolve_index_path(args.index)
+        embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        vectorstore = load_vectorstore(path, embedding)
+        assembler = ContextAssembler(
+            llm_token_counter(os.environ.get("UNIGUIDE_LLM_TOKENIZER", DEFAULT_LLM_TOKENIZER)),
+            token_budget=int(os.environ.get("UNIGUIDE_CONTEXT_TOKENS", "800")),
+        )
+        llm = make_llm()
+        pipeline = RagPipeline(
+            vectorstore, llm, k=int(os.environ.get("UNIGUIDE_TOP_K", "2")),
+            lexical=BM25Index.load(path), metadata=MetadataIndex.load(path), assembler=assembler,
+        )
+
+    rejected = 0
+    started = time.perf_counter()
+    for n, question in enumerate(todo, 1):
+        item = items[question]
+        vector = np.asarray(pipeline.embed(question), dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        if item["answer"]:
+            answer, sources = item["answer"], [item["module_id"]]
+        else:
+            # Поиск только по своему модулю: ответ строится из его документа
+            docs = pipeline.retrieve(question, vector.tolist(), module=item["module_id"])
+            answer = llm.invoke(pipeline.build_prompt(question, docs))
+            sources = sorted({d.metadata.get("module_id") for d in docs if d.metadata.get("module_id")})
+        if not vet_answer(answer):
+            rejected += 1
+            print(f"   ⚠️ Ответ отклонён: {question}")
+            db.execute("DELETE FROM answers WHERE question = ?", (question,))
+            continue
+        db.execute(
+            "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (question, item["module_id"], json.dumps(item["roles"], ensure_ascii=False), item["doc_hash"],
+             item["origin"], answer.strip(), json.dumps(sources, ensure_ascii=False), version,
+             time.time(), vector.astype(np.float32).tobytes()),
+        )
+        if n % 10 == 0:
+            db.commit()
+            print(f"   {n}/{len(todo)} ответов, {n / (time.perf_counter() - started):.2f} ответов/с")
+
+    db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+        ("embedding_model", EMBEDDING_MODEL),
+        ("index_version", version),
+        ("built_at", str(time.time())),
+    ])
+    db.commit()
+    total = db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+    db.close()
+    print(f"✅ Хранилище ответов {store_path}: {total} ответов, отклонено {rejected}")
+
+
+if __name__ == "__main__":
+    main()
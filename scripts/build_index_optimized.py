@@ -1,28 +1,276 @@
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+import argparse
+import glob
+import hashlib
+import json
 import os
+import pickle
+import resource
 import shutil
+import time
 
-print("📥 Загружаем документы...")
-loader = DirectoryLoader(path="data/rag_docs", glob="**/*.md")
-docs = loader.load()
-print(f"✅ Загружено документов: {len(docs)}")
+import numpy as np
 
-splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-chunks = splitter.split_documents(docs)
-print(f"✂️ Чанков получено: {len(chunks)}")
+from doc_metadata import MetadataIndex, parse_doc_header
+from extractive import module_outline, save_modules
+from index_types import create_index, fit_params, parse_spec, spec_string, train_index
+from lexical_index import BM25Index, Lemmatizer, load_lemma_cache
+from md_chunker import MarkdownChunker
+from index_store import (
+    MANIFEST_FILE, VECTORS_FILE, current_version, export_docstore, gc_versions,
+    new_version_dir, publish_version, resolve_index_path, save_index, validate_index,
+)
 
-print("🤖 Получаем embedding через MiniLM (HuggingFace)...")
-embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+DOCS_DIR = "data/rag_docs"
+INDEX_ROOT = "faiss_index"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Размер чанка в токенах модели embedding'ов (MiniLM обрезает вход на 256)
+CHUNK_TOKENS = 256
 
-index_path = "faiss_index"
-if os.path.exists(index_path):
-    print("🗑 Удаляем старый индекс...")
-    shutil.rmtree(index_path)
 
-print("🧱 Строим новый индекс FAISS...")
-db = FAISS.from_documents(chunks, embedding)
-db.save_local(index_path)
-print(f"✅ Новый индекс сохранён в: {index_path}")
+def build_params():
+    # Если что-то из этого поменялось, старые вектора переиспользовать нельзя
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "splitter": "markdown_sections",
+        "chunk_tokens": CHUNK_TOKENS,
+        "metadata_schema": 1,
+    }
+
+
+class ChunkEncoder:
+    # Кодирование чанков явными пачками; при workers > 1 — пулом процессов
+    # sentence-transformers (по процессу на ядро). Результат тот же, что у
+    # HuggingFaceEmbeddings.embed_documents.
+
+    def __init__(self, model_name, workers=1, batch_size=32):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.pool = None
+        if workers > 1:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        if self.pool is not None:
+            vectors = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def embedding_token_counter(model_name):
+    # Длина текста в токенах того же токенизатора, что у модели embedding'ов
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def peak_rss_mb():
+    # Пик памяти сборщика и процессов пула кодирования (Linux: ru_maxrss в КБ)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+def chunk_hash(chunk):
+    source = chunk.metadata.get("source", "")
+    return hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()
+
+
+def load_previous(index_root):
+    # Чанки и вектора текущей опубликованной версии: hash -> (документ, вектор)
+    if current_version(index_root) is None:
+        return None, {}
+    path = resolve_index_path(index_root)
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    except FileNotFoundError:
+        return None, {}
+
+    chunks = {}
+    for position, h in enumerate(manifest["chunks"]):
+        doc = docstore.search(index_to_docstore_id[position])
+        chunks[h] = (doc, vectors[position])
+    return manifest, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка индекса FAISS по data/rag_docs")
+    parser.add_argument("--full", action="store_true", help="Полная пересборка без переиспользования векторов")
+    parser.add_argument("--docs", default=DOCS_DIR, help="Каталог с markdown-документами")
+    parser.add_argument("--index", default=INDEX_ROOT, help="Каталог индекса")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Процессов для кодирования (1 — без пула)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Размер пачки для модели")
+    parser.add_argument("--block-size", type=int, default=1024,
+                        help="Сколько чанков кодировать и добавлять в индекс за раз")
+    parser.add_argument("--index-type", default="flat",
+                        help="Тип индекса и параметры: flat, hnsw:m=32,ef_search=64, ivf:nlist=64,nprobe=8, "
+                             "ivfpq:nlist=64,pq_m=16, ivfsq, hnswsq")
+    args = parser.parse_args()
+    index_kind, index_params = parse_spec(args.index_type)
+
+    params = build_params()
+    prev_manifest, prev_chunks = (None, {}) if args.full else load_previous(args.index)
+    if prev_manifest is not None and prev_manifest.get("params") != params:
+        print("⚠️ Модель или параметры нарезки изменились — полная пересборка")
+        prev_manifest, prev_chunks = None, {}
+    incremental = prev_manifest is not None
+    print("♻️ Инкрементальная сборка" if incremental else "🧱 Полная сборка")
+
+    paths = sorted(glob.glob(os.path.join(args.docs, "**", "*.md"), recursive=True))
+    prev_files = prev_manifest["files"] if incremental else {}
+    print(f"📥 Документов в {args.docs}: {len(paths)}")
+
+    splitter = MarkdownChunker(embedding_token_counter(EMBEDDING_MODEL), max_tokens=CHUNK_TOKENS)
+    files = {}
+    chunks = []  # (hash, документ)
+    outlines = []  # шаги и подсказки модулей для быстрых ответов без LLM
+    changed = added = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        text = raw.decode("utf-8")
+        outlines.append(module_outline(text))
+        prev = prev_files.get(path)
+        if prev is not None and prev["sha256"] == digest and all(h in prev_chunks for h in prev["chunks"]):
+            # Файл не изменился: берём его чанки из предыдущей версии без загрузки
+            file_chunks = [(h, prev_chunks[h][0]) for h in prev["chunks"]]
+        else:
+            if prev is None:
+                added += 1
+            else:
+                changed += 1
+            # Markdown берётся как есть: чанкеру нужны заголовки секций.
+            # Роли и модуль из шапки документа — в метаданные каждого чанка
+            docs = [Document(page_content=text, metadata=dict(parse_doc_header(text), source=path))]
+            file_chunks = [(chunk_hash(c), c) for c in splitter.split_documents(docs)]
+        files[path] = {"sha256": digest, "chunks": [h for h, _ in file_chunks]}
+        chunks.extend(file_chunks)
+    deleted = len(set(prev_files) - set(files))
+    print(f"📄 Файлов: без изменений {len(paths) - changed - added}, изменено {changed}, "
+          f"добавлено {added}, удалено {deleted}")
+    total_tokens = sum(doc.metadata["tokens"] for _, doc in chunks)
+    print(f"✂️ Чанков получено: {len(chunks)}, токенов в индексе: {total_tokens} "
+          f"(в среднем {total_tokens / max(1, len(chunks)):.0f} на чанк)")
+
+    # Вектора берутся из предыдущей версии, если чанк не менялся
+    todo = [i for i, (h, _) in enumerate(chunks) if h not in prev_chunks]
+    encoder = None
+    if todo:
+        print(f"🤖 Получаем embedding через MiniLM для {len(todo)} чанков "
+              f"(процессов: {args.workers}, пачка: {args.batch_size})...")
+        encoder = ChunkEncoder(EMBEDDING_MODEL, workers=args.workers, batch_size=args.batch_size)
+        dimension = encoder.dimension
+    else:
+        dimension = len(next(iter(prev_chunks.values()))[1])
+
+    # Новая версия собирается рядом с текущей; работающий сервер её пока не видит
+    version, build_path = new_version_dir(args.index)
+    try:
+        # Вектора блоками пишутся в vectors.npy на диске, а не копятся целиком в памяти
+        vectors = np.lib.format.open_memmap(
+            os.path.join(build_path, VECTORS_FILE), mode="w+", dtype=np.float32,
+            shape=(len(chunks), dimension),
+        )
+        started = time.perf_counter()
+        encoded = 0
+        for start in range(0, len(chunks), args.block_size):
+            block = chunks[start:start + args.block_size]
+            new = [i for i, (h, _) in enumerate(block) if h not in prev_chunks]
+            rows = np.empty((len(block), dimension), dtype=np.float32)
+            for i, (h, _) in enumerate(block):
+                if h in prev_chunks:
+                    rows[i] = prev_chunks[h][1]
+            if new:
+                rows[new] = encoder.encode([block[i][1].page_content for i in new])
+                encoded += len(new)
+                elapsed = time.perf_counter() - started
+                print(f"   {encoded}/{len(todo)} чанков, {encoded / elapsed:.1f} чанков/с")
+            vectors[start:start + len(block)] = rows
+        vectors.flush()
+        elapsed = time.perf_counter() - started
+        if encoder is not None:
+            encoder.close()
+        print(f"♻️ Переиспользовано чанков: {len(chunks) - len(todo)}, пересчитано: {len(todo)}")
+        if todo:
+            print(f"⏱ Кодирование: {elapsed:.1f} с, {len(todo) / elapsed:.1f} чанков/с")
+
+        # Индекс строится из vectors.npy: IVF/PQ/SQ сначала обучаются на выборке
+        index_kind, index_params, notes = fit_params(index_kind, index_params, len(chunks), dimension)
+        for note in notes:
+            print(f"⚠️ {note}")
+        print(f"🧱 Строим новый индекс FAISS: {spec_string(index_kind, index_params)}...")
+        started = time.perf_counter()
+        index = create_index(index_kind, index_params, dimension)
+        trained = train_index(index, vectors)
+        for start in range(0, len(chunks), args.block_size):
+            index.add(np.ascontiguousarray(vectors[start:start + args.block_size]))
+        del vectors
+        print(f"⏱ Индекс: {time.perf_counter() - started:.1f} с"
+              + (f", обучение на {trained} векторах" if trained else ""))
+
+        save_index(build_path, index, [doc for _, doc in chunks])
+        export_docstore(build_path)
+
+        metadata = MetadataIndex.build([doc.metadata for _, doc in chunks])
+        metadata.save(build_path)
+        stats = metadata.stats()
+        print(f"🏷 Метаданные: ролей {stats['roles']}, модулей {stats['modules']}, "
+              f"чанков без ограничений по ролям {stats['unrestricted']}")
+        print(f"🪜 Модулей для быстрых ответов: {save_modules(build_path, outlines)}")
+
+        # Лексический индекс BM25 по тем же чанкам; словарь лемм берётся из прошлой версии
+        prev_lemmas = load_lemma_cache(resolve_index_path(args.index)) if incremental else {}
+        lemmatizer = Lemmatizer(prev_lemmas)
+        lexical = BM25Index.build([doc.page_content for _, doc in chunks], lemmatizer)
+        lexical.save(build_path)
+        print(f"🔤 BM25: {len(lexical.postings)} лемм, новых слов в словаре: "
+              f"{len(lemmatizer.cache) - len(prev_lemmas)}")
+        with open(os.path.join(build_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "params": params,
+                "files": files,
+                "chunks": [h for h, _ in chunks],
+                "tokens": total_tokens,
+                "index_type": {"kind": index_kind, "params": index_params},
+                "reused": len(chunks) - len(todo),
+                "recomputed": len(todo),
+            }, f, ensure_ascii=False, indent=2)
+        count = validate_index(build_path)
+    except Exception:
+        if encoder is not None:
+            encoder.close()
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+    print(f"🔎 Проверка пройдена: {count} векторов")
+    own_rss, pool_rss = peak_rss_mb()
+    print(f"📈 Пик памяти: сборщик {own_rss} МБ, крупнейший процесс пула {pool_rss} МБ")
+
+    final_path = publish_version(args.index, version, build_path)
+    print(f"✅ Новый индекс опубликован: {final_path}")
+
+    removed = gc_versions(args.index, keep=3)
+    if removed:
+        print(f"🗑 Удалены старые версии: {', '.join(removed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+import threading
+
+from token_count import approx_tokens
+
+logger = logging.getLogger("uniguide.context")
+
+# Перекрытие короче этого считается совпадением случайных символов, а не склейкой чанков
+_MIN_OVERLAP = 20
+_MAX_OVERLAP = 400
+# Строки короче этого (заголовки секций, «1. Нажмите „Сохранить“») между разными
+# документами не считаются повтором
+_MIN_DUPLICATE_LINE = 30
+_SPACES = re.compile(r"\s+")
+
+
+def _line_key(line):
+    return _SPACES.sub(" ", line).strip().lower()
+
+
+def _merge_texts(first, second):
+    # Склейка двух чанков одного файла: вложенность или перекрытие конца с началом.
+    # None — чанки не соседние.
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for a, b in ((first, second), (second, first)):
+        for n in range(min(len(a), len(b), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+            if a.endswith(b[:n]):
+                return a + b[n:]
+    return None
+
+
+class ContextAssembler:
+    # Сборка контекста для prompt вместо склейки чанков целиком:
+    # чанки одного файла объединяются (перекрытия и повторы строк убираются),
+    # блоки идут в порядке релевантности и добавляются, пока помещаются
+    # в token_budget токенов LLM.
+
+    def __init__(self, count_tokens=approx_tokens, token_budget=800):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.context_tokens = 0
+        self.merged_chunks = 0
+        self.dropped_lines = 0
+        self.truncated = 0
+
+    def _blocks(self, docs):
+        # Блок на каждый исходный файл, в порядке первого появления в выдаче
+        blocks = {}
+        merged = 0
+        for doc in docs:
+            source = doc.metadata.get("source") or id(doc)
+            text = doc.page_content.strip()
+            if source not in blocks:
+                blocks[source] = [text]
+                continue
+            merged += 1
+            parts = blocks[source]
+            for i, part in enumerate(parts):
+                joined = _merge_texts(part, text)
+                if joined is not None:
+                    parts[i] = joined
+                    break
+            else:
+                parts.append(text)
+        return ["\n".join(parts) for parts in blocks.values()], merged
+
+    def _dedup_lines(self, block, seen):
+        # Внутри блока убираются все повторы строк (шапка модуля у каждого чанка),
+        # между блоками — только длинные совпадающие строки
+        own, lines, dropped = set(), [], 0
+        for line in block.splitlines():
+            key = _line_key(line)
+            if key and (key in own or (len(key) >= _MIN_DUPLICATE_LINE and key in seen)):
+                dropped += 1
+                continue
+            if key:
+                own.add(key)
+            lines.append(line)
+        seen.update(k for k in own if len(k) >= _MIN_DUPLICATE_LINE)
+        return "\n".join(lines), dropped
+
+    def assemble(self, docs):
+        # Возвращает (контекст, число токенов контекста)
+        blocks, merged = self._blocks(docs)
+        seen, parts, used, dropped, truncated = set(), [], 0, 0, False
+        for block in blocks:
+            block, removed = self._dedup_lines(block, seen)
+            dropped += removed
+            tokens = self.count_tokens(block)
+            if used + tokens <= self.token_budget:
+                parts.append(block)
+                used += tokens
+                continue
+            # Не помещается целиком: берутся первые строки блока, дальше бюджета нет
+            truncated = True
+            lines = []
+            for line in block.splitlines():
+                tokens = self.count_tokens("\n".join(lines + [line]))
+                if used + tokens > self.token_budget:
+                    break
+                lines.append(line)
+            if lines:
+                parts.append("\n".join(lines))
+                used += self.count_tokens(parts[-1])
+            break
+        with self._lock:
+            self.merged_chunks += merged
+            self.dropped_lines += dropped
+            self.truncated += truncated
+            self.context_tokens += used
+        return "\n\n".join(parts), used
+
+    def record_prompt(self, prompt):
+        tokens = self.count_tokens(prompt)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+        return tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "requests": self.requests,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.requests) if self.requests else 0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "avg_context_tokens": round(self.context_tokens / self.requests) if self.requests else 0,
+                "merged_chunks": self.merged_chunks,
+                "dropped_lines": self.dropped_lines,
+                "truncated": self.truncated,
+            }
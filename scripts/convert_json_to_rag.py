@@ -12,7 +12,10 @@ def extract_keywords(text):
     words = re.findall(r'\b[а-яА-Яa-zA-Z]{4,}\b', text)
     return list(sorted(set(words[:8])))
 
-def json_to_md(module):
+def json_to_md(module, metadata=None):
+    # metadata — блок "metadata" исходного файла: doc_id, аудитория и теги
+    # попадают в шапку и потом используются для фильтрации поиска
+    metadata = metadata or module.get("metadata") or {}
     title = module.get("title", "Без названия")
     module_id = module.get("id", "-")
     available_roles = ", ".join(module.get("available_roles", []))
@@ -32,6 +35,14 @@ def json_to_md(module):
         f"# 📘 Модуль: {title}",
         f"**ID**: {module_id}",
         f"**Доступно для**: {available_roles}",
+    ]
+    if metadata.get("doc_id"):
+        lines.append(f"**Документ**: {metadata['doc_id']}")
+    if metadata.get("audience"):
+        lines.append(f"**Аудитория**: {metadata['audience']}")
+    if metadata.get("tags"):
+        lines.append("**Теги**: " + ", ".join(metadata["tags"]))
+    lines += [
         "",
         "## 📝 Описание",
         description,
@@ -91,6 +102,6 @@ for filename in os.listdir(INPUT_DIR):
             file_id = module.get("id", os.path.splitext(filename)[0])
             out_file = os.path.join(OUTPUT_DIR, f"{file_id}.md")
             with open(out_file, "w", encoding="utf-8") as out:
-                out.write(json_to_md(module))
+                out.write(json_to_md(module, data.get("metadata")))
 
 print(f"✅ Преобразование завершено. Файлы в папке: {OUTPUT_DIR}")
\ No newline at end of file
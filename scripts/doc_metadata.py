@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+METADATA_INDEX_FILE = "metadata_index.json"
+
+# Поля шапки markdown из convert_json_to_rag.json_to_md
+_HEADER_FIELDS = {
+    "ID": "module_id",
+    "Доступно для": "roles",
+    "Документ": "doc_id",
+    "Аудитория": "audience",
+    "Теги": "tags",
+}
+_HEADER_LINE = re.compile(r"^\*\*(.+?)\*\*:\s*(.*)$")
+_LIST_FIELDS = ("roles", "tags")
+# Аудитория «все» фильтра не ограничивает
+_OPEN_AUDIENCE = {"everyone", "all", "все"}
+
+
+def normalize_label(value):
+    return value.strip().lower().replace("ё", "е")
+
+
+def parse_doc_header(text):
+    # Метаданные из шапки документа rag_docs: ID модуля, роли, а также doc_id,
+    # аудитория и теги исходного JSON, если они есть
+    meta = {}
+    title = None
+    for line in text.splitlines()[:12]:
+        if line.startswith("# ") and title is None:
+            title = line.lstrip("# ").replace("📘 Модуль:", "").strip()
+            continue
+        match = _HEADER_LINE.match(line.strip())
+        if not match or match.group(1) not in _HEADER_FIELDS:
+            continue
+        key, value = _HEADER_FIELDS[match.group(1)], match.group(2).strip()
+        if key in _LIST_FIELDS:
+            meta[key] = [normalize_label(v) for v in value.split(",") if v.strip()]
+        elif value and value != "-":
+            meta[key] = value
+    if title:
+        meta["title"] = title
+    return meta
+
+
+def access_labels(meta):
+    # Роли, которым доступен документ: «Доступно для» и аудитория; пусто — доступен всем
+    labels = list(meta.get("roles") or [])
+    audience = normalize_label(meta.get("audience") or "")
+    if audience and audience not in _OPEN_AUDIENCE:
+        labels.append(audience)
+    return labels
+
+
+class MetadataIndex:
+    # Заранее посчитанные множества позиций векторов по роли и модулю.
+    # Фильтр применяется внутри поиска FAISS (IDSelector), а не после него.
+    # Аудитория документа (students, staff_only) работает как ещё одна роль.
+    # Документ без ролей и аудитории доступен всем.
+
+    def __init__(self, roles, modules, unrestricted, total):
+        self.roles = {r: np.asarray(p, dtype=np.int64) for r, p in roles.items()}
+        self.modules = {m: np.asarray(p, dtype=np.int64) for m, p in modules.items()}
+        self.unrestricted = np.asarray(unrestricted, dtype=np.int64)
+        self.total = total
+        self._lock = threading.Lock()
+        self._selectors = {}
+
+    @classmethod
+    def build(cls, metadatas):
+        roles, modules, unrestricted = {}, {}, []
+        for position, meta in enumerate(metadatas):
+            doc_roles = access_labels(meta)
+            if not doc_roles:
+                unrestricted.append(position)
+            for role in doc_roles:
+                roles.setdefault(role, []).append(position)
+            labels = {normalize_label(meta[key]) for key in ("module_id", "doc_id") if meta.get(key)}
+            for label in labels:
+                modules.setdefault(label, []).append(position)
+        return cls(roles, modules, unrestricted, len(metadatas))
+
+    def save(self, index_path):
+        data = {
+            "roles": {r: p.tolist() for r, p in self.roles.items()},
+            "modules": {m: p.tolist() for m, p in self.modules.items()},
+            "unrestricted": self.unrestricted.tolist(),
+            "total": self.total,
+        }
+        with open(os.path.join(index_path, METADATA_INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_path):
+        path = os.path.join(index_path, METADATA_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["roles"], data["modules"], data["unrestricted"], data["total"])
+
+    def allowed(self, role=None, module=None):
+        # None — фильтра нет; иначе отсортированный массив разрешённых позиций
+        result = None
+        if role:
+            role_positions = self.roles.get(normalize_label(role), np.empty(0, dtype=np.int64))
+            result = np.union1d(role_positions, self.unrestricted)
+        if module:
+            module_positions = self.modules.get(normalize_label(module), np.empty(0, dtype=np.int64))
+            result = module_positions if result is None else np.intersect1d(result, module_positions)
+        return result
+
+    def selector(self, role=None, module=None):
+        # (множество позиций, faiss.IDSelector) для фильтра; кэшируется, ролей и модулей немного
+        key = (normalize_label(role or ""), normalize_label(module or ""))
+        with self._lock:
+            cached = self._selectors.get(key)
+        if cached is not None:
+            return cached
+        import faiss
+
+        positions = self.allowed(role, module)
+        if positions is None:
+            return None
+        cached = (set(positions.tolist()), faiss.IDSelectorBatch(positions))
+        with self._lock:
+            # Ключи приходят из запросов, поэтому кэш ограничен
+            if len(self._selectors) < 256:
+                self._selectors[key] = cached
+        return cached
+
+    def stats(self):
+        return {
+            "roles": len(self.roles),
+            "modules": len(self.modules),
+            "unrestricted": int(len(self.unrestricted)),
+            "total": self.total,
+        }
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+
+class MicroBatchEmbeddings(Embeddings):
+    # Собирает запросы embed_query из разных потоков в пачки и делает
+    # один embed_documents на всю пачку. В пачку идёт всё, что накопилось,
+    # пока модель кодировала предыдущую; одиночный запрос кодируется сразу.
+    # max_wait > 0 — дополнительно ждать попутчиков до max_wait секунд.
+
+    def __init__(self, inner, max_batch=16, max_wait=0.0):
+        self.inner = inner
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+            try:
+                vectors = self.inner.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            queries = sum(size * n for size, n in self._batch_sizes.items())
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(1000 * self.max_wait, 1),
+                "batches": batches,
+                "queries": queries,
+                "avg_batch": round(queries / batches, 2) if batches else 0.0,
+                "batch_sizes": {str(size): n for size, n in sorted(self._batch_sizes.items())},
+            }
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from answer_store import canonical_questions
+from benchmark import BENCH_QUESTIONS, EMBEDDING_MODEL
+from doc_metadata import parse_doc_header
+from index_store import VECTORS_FILE, resolve_index_path
+from index_types import create_index, fit_params, parse_spec, spec_string, train_index
+
+DEFAULT_SPECS = (
+    "flat",
+    "hnsw:m=16,ef_search=32",
+    "hnsw:m=32,ef_search=64",
+    "ivf:nprobe=4",
+    "ivf:nprobe=16",
+    "ivfpq",
+    "ivfsq",
+    "hnswsq",
+)
+
+
+def question_vectors(docs_dir):
+    # Реалистичные запросы: вопросы из замеров и типовые вопросы по каждому модулю
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    questions = list(BENCH_QUESTIONS)
+    for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.md"), recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        questions.extend(canonical_questions(parse_doc_header(text), text))
+    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return np.asarray(embedding.embed_documents(questions), dtype=np.float32)
+
+
+def synthetic_vectors(vectors, n, noise=0.05, seed=0):
+    # Без модели: вектора случайных чанков с шумом (recall получается оптимистичным)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n, len(vectors)), replace=False)
+    sample = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    scale = noise * np.linalg.norm(sample, axis=1, keepdims=True) / np.sqrt(sample.shape[1])
+    return (sample + rng.normal(size=sample.shape) * scale).astype(np.float32)
+
+
+def evaluate(kind, params, vectors, queries, truth, k):
+    kind, params, notes = fit_params(kind, params, len(vectors), vectors.shape[1])
+    started = time.perf_counter()
+    index = create_index(kind, params, vectors.shape[1])
+    train_index(index, vectors)
+    index.add(vectors)
+    build_s = time.perf_counter() - started
+
+    # Задержка одиночного запроса, как в сервере
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, positions = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        found[i] = positions[0]
+    latencies = np.asarray(latencies) * 1000
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        "spec": spec_string(kind, params),
+        "recall_at_k": round(float(recall), 4),
+        "top1": round(float(np.mean(found[:, 0] == truth[:, 0])), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "size_mb": round(len(faiss.serialize_index(index)) / 2 ** 20, 2),
+        "build_s": round(build_s, 2),
+        "notes": notes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k, задержка и размер разных типов индекса FAISS")
+    parser.add_argument("--index", default="faiss_index", help="Каталог индекса (берутся его vectors.npy)")
+    parser.add_argument("--docs", default="data/rag_docs", help="Документы для типовых вопросов")
+    parser.add_argument("--specs", nargs="+", default=DEFAULT_SPECS, help="Описания индексов, как в --index-type")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Вместо вопросов — столько зашумлённых векторов чанков (без модели)")
+    parser.add_argument("--threads", type=int, default=1, help="Потоков OpenMP у FAISS")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = np.ascontiguousarray(np.load(os.path.join(resolve_index_path(args.index), VECTORS_FILE)))
+    queries = synthetic_vectors(vectors, args.synthetic) if args.synthetic else question_vectors(args.docs)
+    k = min(args.k, len(vectors))
+    print(f"📐 Векторов: {len(vectors)}, размерность {vectors.shape[1]}, запросов: {len(queries)}, k={k}")
+
+    # Эталон — точный поиск
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    print(f"{'индекс':<52} {'recall@k':>9} {'top1':>6} {'p50 ms':>8} {'p95 ms':>8} {'МБ':>7} {'сборка с':>9}")
+    for text in args.specs:
+        kind, params = parse_spec(text)
+        result = evaluate(kind, params, vectors, queries, truth, k)
+        results.append(result)
+        print(f"{result['spec']:<52} {result['recall_at_k']:>9.3f} {result['top1']:>6.2f} "
+              f"{result['latency_ms_p50']:>8.3f} {result['latency_ms_p95']:>8.3f} "
+              f"{result['size_mb']:>7.2f} {result['build_s']:>9.2f}")
+        for note in result["notes"]:
+            print(f"   ⚠️ {note}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(vectors), "queries": len(queries), "k": k, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
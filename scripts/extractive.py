@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+
+from doc_metadata import parse_doc_header
+from md_chunker import parse_sections
+
+MODULES_FILE = "modules.json"
+ANSWER_MODES = ("extractive", "generative", "auto")
+
+
+def module_outline(text):
+    # Название, шаги и подсказки интерфейса модуля из документа json_to_md
+    meta = parse_doc_header(text)
+    _, sections = parse_sections(text)
+    outline = {
+        "title": meta.get("title"),
+        "module_id": meta.get("module_id") or meta.get("doc_id"),
+        "steps": [],
+        "hints": [],
+    }
+    for name, lines in sections:
+        if name == "Шаги":
+            outline["steps"].extend(line.strip() for line in lines[1:] if line.strip())
+        elif name == "Подсказки интерфейса":
+            outline["hints"].extend(line.strip() for line in lines[1:] if line.strip())
+    return outline
+
+
+def save_modules(index_path, outlines):
+    modules = {o["module_id"]: o for o in outlines if o["module_id"]}
+    with open(os.path.join(index_path, MODULES_FILE), "w", encoding="utf-8") as f:
+        json.dump(modules, f, ensure_ascii=False)
+    return len(modules)
+
+
+class ExtractiveAnswerer:
+    # Быстрый ответ без LLM: шаги и подсказки модуля, который поиск уверенно ставит первым.
+    # Уверенность — относительный отрыв L2-расстояния лучшего чанка другого модуля
+    # от расстояния первого: (d2 - d1) / d2 >= margin.
+
+    def __init__(self, modules, margin=0.15, link_base=""):
+        self.modules = modules
+        self.margin = margin
+        self.link_base = link_base
+        self._lock = threading.Lock()
+        self.requests = {mode: 0 for mode in ANSWER_MODES}
+        self.extractive = {mode: 0 for mode in ANSWER_MODES}
+
+    @classmethod
+    def load(cls, index_path, margin=0.15, link_base=""):
+        path = os.path.join(index_path, MODULES_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), margin=margin, link_base=link_base)
+
+    def confident(self, hits):
+        # hits — [(module_id, расстояние)] по возрастанию расстояния
+        if not hits:
+            return False
+        top_module, top = hits[0]
+        for module_id, distance in hits[1:]:
+            if module_id != top_module:
+                return distance > 0 and (distance - top) / distance >= self.margin
+        return True
+
+    def format_answer(self, outline):
+        lines = [f"**{outline['title']}**", ""]
+        lines.extend(outline["steps"])
+        if outline["hints"]:
+            lines += ["", "Подсказки:"]
+            lines.extend(outline["hints"])
+        source = f"{self.link_base}{outline['module_id']}" if self.link_base else outline["module_id"]
+        lines += ["", f"Источник: {source}"]
+        return "\n".join(lines)
+
+    def answer(self, hits, mode):
+        # Готовый ответ или None, если нужна генерация
+        result = None
+        if hits and (mode == "extractive" or self.confident(hits)):
+            outline = self.modules.get(hits[0][0])
+            if outline and outline["steps"]:
+                result = self.format_answer(outline)
+        self.record(mode, result is not None)
+        return result
+
+    def record(self, mode, extractive):
+        with self._lock:
+            self.requests[mode] += 1
+            self.extractive[mode] += extractive
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.requests.values())
+            served = sum(self.extractive.values())
+            return {
+                "modules": len(self.modules),
+                "margin": self.margin,
+                "requests": dict(self.requests),
+                "extractive": dict(self.extractive),
+                "absorbed_rate": round(served / total, 3) if total else 0.0,
+            }
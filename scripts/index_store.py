@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger("uniguide.index")
+
+INDEX_FILES = ("index.faiss", "index.pkl")
+DOCSTORE_FILE = "docstore.sqlite"
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+# Раскладка каталога индекса:
+#   faiss_index/CURRENT             — имя опубликованной версии
+#   faiss_index/versions/<версия>/  — неизменяемые файлы одной сборки
+# Если CURRENT нет, используются файлы прямо в faiss_index/ (старая раскладка).
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_path(root):
+    version = current_version(root)
+    if version is None:
+        return root
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def index_version(root):
+    # Версия индекса: имя из CURRENT, а для старой раскладки —
+    # размеры и время изменения файлов. Меняется при каждой пересборке.
+    version = current_version(root)
+    if version is not None:
+        return version
+    parts = []
+    for name in INDEX_FILES:
+        try:
+            st = os.stat(os.path.join(root, name))
+        except FileNotFoundError:
+            parts.append(f"{name}:missing")
+            continue
+        parts.append(f"{name}:{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def new_version_dir(root):
+    # Сборка пишется во временный каталог и становится версией только после проверки
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = os.path.join(root, VERSIONS_DIR, version + ".building")
+    os.makedirs(path)
+    return version, path
+
+
+def validate_index(path):
+    import faiss
+
+    for name in INDEX_FILES:
+        if not os.path.exists(os.path.join(path, name)):
+            raise ValueError(f"В {path} нет файла {name}")
+    index = faiss.read_index(os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    if index.ntotal == 0:
+        raise ValueError("Индекс пуст")
+    if index.ntotal != len(index_to_docstore_id):
+        raise ValueError(f"Векторов {index.ntotal}, а документов {len(index_to_docstore_id)}")
+    missing = [i for i in index_to_docstore_id.values() if i not in docstore._dict]
+    if missing:
+        raise ValueError(f"В docstore нет {len(missing)} документов")
+    return index.ntotal
+
+
+def publish_version(root, version, build_path):
+    # Атомарная публикация: каталог переименовывается, затем CURRENT заменяется через os.replace
+    final_path = os.path.join(root, VERSIONS_DIR, version)
+    os.replace(build_path, final_path)
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    return final_path
+
+
+def gc_versions(root, keep=3):
+    # Удаляет старые версии, оставляя keep последних (текущая не удаляется никогда)
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    current = current_version(root)
+    versions = sorted(v for v in os.listdir(versions_dir) if not v.endswith(".building"))
+    removed = []
+    for version in versions[:-keep] if keep else versions:
+        if version == current:
+            continue
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+        removed.append(version)
+    return removed
+
+
+def save_index(path, index, docs):
+    # Те же файлы, что пишет FAISS.save_local, но без объекта embeddings:
+    # вектора уже посчитаны (или взяты из предыдущей версии).
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    ids = [str(uuid.uuid4()) for _ in docs]
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "index.pkl"), "wb") as f:
+        pickle.dump((InMemoryDocstore(dict(zip(ids, docs))), dict(enumerate(ids))), f)
+
+
+def export_docstore(index_path):
+    # Переносит docstore из index.pkl в SQLite-файл рядом с индексом.
+    # Его читают все воркеры через общий page cache, а не держат по копии в памяти.
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    path = os.path.join(index_path, DOCSTORE_FILE)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("CREATE TABLE documents (id TEXT PRIMARY KEY, page_content TEXT, metadata TEXT)")
+    conn.execute("CREATE TABLE id_map (position INTEGER PRIMARY KEY, id TEXT)")
+    conn.executemany(
+        "INSERT INTO documents VALUES (?, ?, ?)",
+        (
+            (doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for doc_id, doc in docstore._dict.items()
+        ),
+    )
+    conn.executemany("INSERT INTO id_map VALUES (?, ?)", index_to_docstore_id.items())
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return len(index_to_docstore_id)
+
+
+class SqliteDocstore:
+    # Docstore только для чтения поверх docstore.sqlite (интерфейс Docstore.search).
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def search(self, search):
+        from langchain_core.documents import Document
+
+        row = self._conn().execute(
+            "SELECT page_content, metadata FROM documents WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def id_map(self):
+        rows = self._conn().execute("SELECT position, id FROM id_map").fetchall()
+        return dict(rows)
+
+
+def read_index_mmap(path):
+    # Flat/SQ/PQ отображаются целиком (IO_FLAG_MMAP_IFC), у IVF — списки векторов
+    # (IO_FLAG_MMAP); сочетание обоих флагов IVF не читает
+    import faiss
+
+    base = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(path, base | ifc)
+    except RuntimeError:
+        if not ifc:
+            raise
+        return faiss.read_index(path, base)
+
+
+def load_vectorstore(index_path, embedding, mmap=False):
+    # mmap=True: index.faiss открывается отображённым в память и только для чтения,
+    # так что несколько процессов uvicorn делят одни и те же страницы.
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    if not mmap:
+        return FAISS.load_local(index_path, embedding, allow_dangerous_deserialization=True)
+
+    index = read_index_mmap(os.path.join(index_path, "index.faiss"))
+
+    docstore_path = os.path.join(index_path, DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        docstore = SqliteDocstore(docstore_path)
+        index_to_docstore_id = docstore.id_map()
+    else:
+        with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding, index, docstore, index_to_docstore_id)
+
+
+class IndexWatcher:
+    # Фоновый поток: раз в interval секунд сверяет версию индекса
+    # и вызывает on_change(версия, путь) при публикации новой.
+
+    def __init__(self, root, version, on_change, interval=10):
+        self.root = root
+        self.version = version
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._loop, name="index-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            version = index_version(self.root)
+            if version == self.version:
+                continue
+            logger.info("🔄 Найдена новая версия индекса: %s", version)
+            try:
+                self.on_change(version, resolve_index_path(self.root))
+            except Exception as e:
+                # Старый индекс продолжает работать; попробуем снова на следующем шаге
+                self.failures += 1
+                logger.exception("Не удалось загрузить версию %s: %s", version, e)
+                continue
+            self.version = version
+            self.reloads += 1
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "interval_sec": self.interval,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Служебные операции с индексом FAISS")
+    parser.add_argument("command", choices=["export-docstore", "gc"])
+    parser.add_argument("--index", default="faiss_index", help="Каталог индекса")
+    parser.add_argument("--keep", type=int, default=3, help="Сколько версий оставить (для gc)")
+    args = parser.parse_args()
+
+    if args.command == "export-docstore":
+        path = resolve_index_path(args.index)
+        count = export_docstore(path)
+        print(f"✅ docstore.sqlite: {count} документов в {path}")
+    elif args.command == "gc":
+        removed = gc_versions(args.index, keep=args.keep)
+        print(f"🗑 Удалено версий: {len(removed)} {removed}")
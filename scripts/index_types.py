@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# Типы индекса FAISS и параметры по умолчанию. Описание в командной строке:
+#   flat | hnsw:m=32,ef_search=64 | ivf:nlist=64,nprobe=8 | ivfpq:nlist=64,pq_m=16 | ivfsq | hnswsq
+INDEX_TYPES = {
+    "flat": {},
+    "hnsw": {"m": 32, "ef_construction": 40, "ef_search": 64},
+    "ivf": {"nlist": 64, "nprobe": 8},
+    "ivfpq": {"nlist": 64, "nprobe": 8, "pq_m": 16, "pq_bits": 8},
+    "ivfsq": {"nlist": 64, "nprobe": 8, "sq": "SQ8"},
+    "hnswsq": {"m": 32, "ef_construction": 40, "ef_search": 64, "sq": "SQ8"},
+}
+# k-means FAISS просит не меньше 39 точек на центроид
+_POINTS_PER_CENTROID = 39
+
+
+def parse_spec(text):
+    # "hnsw:m=16,ef_search=128" -> ("hnsw", {"m": 16, "ef_construction": 40, "ef_search": 128})
+    kind, _, rest = text.strip().lower().partition(":")
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Неизвестный тип индекса {kind!r}, доступны: {', '.join(INDEX_TYPES)}")
+    params = dict(INDEX_TYPES[kind])
+    for item in filter(None, rest.split(",")):
+        key, _, value = item.partition("=")
+        if key not in params:
+            raise ValueError(f"У индекса {kind} нет параметра {key!r}, есть: {', '.join(params) or '-'}")
+        params[key] = value.upper() if key == "sq" else int(value)
+    return kind, params
+
+
+def spec_string(kind, params):
+    if not params:
+        return kind
+    return kind + ":" + ",".join(f"{k}={v}" for k, v in params.items())
+
+
+def fit_params(kind, params, n, dimension):
+    # Параметры под размер коллекции: на маленьком корпусе nlist и pq_bits уменьшаются,
+    # чтобы обучению хватило точек; если точек мало даже для pq_bits=4, IVF-PQ заменяется
+    # на IVF-SQ8, а совсем маленькая коллекция для IVF — на Flat.
+    # Возвращает (тип, параметры, список поправок).
+    params = dict(params)
+    notes = []
+    if kind == "ivfpq" and n < _POINTS_PER_CENTROID * 2 ** 4:
+        fallback = {"nlist": params["nlist"], "nprobe": params["nprobe"], "sq": INDEX_TYPES["ivfsq"]["sq"]}
+        notes.append(f"ivfpq -> ivfsq: для обучения PQ нужно не меньше "
+                     f"{_POINTS_PER_CENTROID * 2 ** 4} векторов, есть {n}")
+        kind, params = "ivfsq", fallback
+    if "nlist" in params and n < _POINTS_PER_CENTROID:
+        notes.append(f"{kind} -> flat: для обучения IVF нужно не меньше {_POINTS_PER_CENTROID} векторов, есть {n}")
+        return "flat", {}, notes
+    if "nlist" in params:
+        nlist = max(1, min(params["nlist"], n // _POINTS_PER_CENTROID))
+        if nlist != params["nlist"]:
+            notes.append(f"nlist {params['nlist']} -> {nlist} (векторов {n})")
+            params["nlist"] = nlist
+        params["nprobe"] = min(params["nprobe"], params["nlist"])
+    if "pq_m" in params:
+        if dimension % params["pq_m"]:
+            raise ValueError(f"pq_m={params['pq_m']} должно делить размерность {dimension}")
+        bits = params["pq_bits"]
+        while bits > 4 and n < _POINTS_PER_CENTROID * 2 ** bits:
+            bits -= 1
+        if bits != params["pq_bits"]:
+            notes.append(f"pq_bits {params['pq_bits']} -> {bits} (векторов {n})")
+            params["pq_bits"] = bits
+    return kind, params, notes
+
+
+def factory_string(kind, params):
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{params['m']}"
+    if kind == "ivf":
+        return f"IVF{params['nlist']},Flat"
+    if kind == "ivfpq":
+        return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_bits']}"
+    if kind == "ivfsq":
+        return f"IVF{params['nlist']},{params['sq']}"
+    return f"HNSW{params['m']},{params['sq']}"
+
+
+def create_index(kind, params, dimension):
+    import faiss
+
+    index = faiss.index_factory(dimension, factory_string(kind, params))
+    if "ef_construction" in params:
+        index.hnsw.efConstruction = params["ef_construction"]
+    set_search_params(index, params)
+    return index
+
+
+def set_search_params(index, params):
+    # nprobe и efSearch сохраняются в index.faiss вместе с индексом
+    import faiss
+
+    space = faiss.ParameterSpace()
+    if "nprobe" in params:
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "ef_search" in params:
+        space.set_index_parameter(index, "efSearch", params["ef_search"])
+
+
+def train_index(index, vectors, max_points=100000, seed=0):
+    # Обучение IVF/PQ/SQ на случайной выборке векторов (Flat и HNSW не обучаются)
+    if index.is_trained:
+        return 0
+    rows = np.arange(len(vectors))
+    if len(rows) > max_points:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, max_points, replace=False))
+    sample = np.ascontiguousarray(vectors[rows], dtype=np.float32)
+    index.train(sample)
+    return len(sample)
+
+
+def search_parameters(index, selector):
+    # Параметры поиска с фильтром: IVF и HNSW принимают только свои классы параметров,
+    # а nprobe / efSearch в них иначе сбрасываются на значения по умолчанию
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
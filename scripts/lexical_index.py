@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+
+LEXICAL_FILE = "lexical.pkl"
+
+_TOKEN = re.compile(r"[а-яёa-z0-9]+", re.IGNORECASE)
+_STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "из", "за",
+    "для", "не", "ли", "а", "но", "или", "что", "как", "где", "это", "то", "же", "бы",
+    "у", "при", "можно", "мне", "я", "мы", "вы",
+}
+
+
+class Lemmatizer:
+    # Лемматизация pymorphy3 с кэшем «слово -> лемма».
+    # Кэш сохраняется вместе с лексическим индексом и подгружается при следующей сборке;
+    # max_cache не даёт ему бесконечно расти от слов из пользовательских запросов.
+
+    def __init__(self, cache=None, max_cache=200000):
+        import pymorphy3
+
+        self._morph = pymorphy3.MorphAnalyzer()
+        self.cache = dict(cache or {})
+        self.max_cache = max_cache
+
+    def lemma(self, word):
+        word = word.lower().replace("ё", "е")
+        lemma = self.cache.get(word)
+        if lemma is None:
+            lemma = self._morph.parse(word)[0].normal_form.replace("ё", "е")
+            if len(self.cache) < self.max_cache:
+                self.cache[word] = lemma
+        return lemma
+
+    def tokens(self, text):
+        words = (w for w in _TOKEN.findall(text) if w.lower() not in _STOPWORDS)
+        return [self.lemma(w) for w in words]
+
+
+class BM25Index:
+    # Инвертированный индекс BM25 по тем же чанкам, что и FAISS:
+    # номер документа совпадает с позицией вектора в index.faiss.
+
+    def __init__(self, postings, doc_lengths, lemmatizer, k1=1.5, b=0.75):
+        self.postings = postings  # лемма -> [(позиция, tf)]
+        self.doc_lengths = doc_lengths
+        self.lemmatizer = lemmatizer
+        self.k1 = k1
+        self.b = b
+        self.avgdl = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        n = len(doc_lengths)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, texts, lemmatizer):
+        postings = defaultdict(list)
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            terms = Counter(lemmatizer.tokens(text))
+            doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings[term].append((position, tf))
+        return cls(dict(postings), doc_lengths, lemmatizer)
+
+    def search(self, query, k=10, allowed=None):
+        # allowed — необязательное множество позиций, среди которых искать
+        scores = defaultdict(float)
+        for term in set(self.lemmatizer.tokens(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, tf in self.postings[term]:
+                if allowed is not None and position not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avgdl)
+                scores[position] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def save(self, index_path):
+        data = {
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+            "lemmas": self.lemmatizer.cache,
+            "k1": self.k1,
+            "b": self.b,
+        }
+        with open(os.path.join(index_path, LEXICAL_FILE), "wb") as f:
+            pickle.dump(data, f)
+
+    @classmethod
+    def load(cls, index_path, lemmatizer=None):
+        path = os.path.join(index_path, LEXICAL_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        lemmatizer = lemmatizer or Lemmatizer(data["lemmas"])
+        return cls(data["postings"], data["doc_lengths"], lemmatizer, k1=data["k1"], b=data["b"])
+
+
+def load_lemma_cache(index_path):
+    path = os.path.join(index_path, LEXICAL_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return pickle.load(f)["lemmas"]
+
+
+def rrf_fuse(rankings, k=60):
+    # Reciprocal rank fusion: каждый список — позиции документов по убыванию релевантности
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            scores[position] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda position: -scores[position])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("uniguide.startup")
+
+
+def memory_usage():
+    # Память процесса (Linux, /proc): RssFile включает разделяемые mmap-страницы
+    # индекса, а Pss делит их между процессами — по нему удобно считать память на воркер.
+    result = {"pid": os.getpid()}
+    fields = {"VmRSS": "rss_mb", "VmHWM": "peak_rss_mb", "RssAnon": "rss_anon_mb", "RssFile": "rss_file_mb"}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    result[fields[key]] = round(int(value.split()[0]) / 1024, 1)
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "Pss":
+                    result["pss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        import resource
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+class NotReadyError(Exception):
+    def __init__(self, retry_after=5):
+        super().__init__("Сервер ещё запускается, повторите запрос позже")
+        self.retry_after = retry_after
+
+
+class Startup:
+    # Запуск сервера по фазам с замером времени каждой фазы.
+    # ready выставляется только после успешного прогрева.
+    # warnings — деградации, с которыми сервер всё же работает (видны в /readyz и /stats).
+
+    def __init__(self):
+        self.phases = {}
+        self.error = None
+        self.warnings = []
+        self._ready = threading.Event()
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        logger.info("▶ %s...", name)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            logger.exception("❌ %s: %s", name, e)
+            raise
+        elapsed = time.perf_counter() - started
+        self.phases[name] = round(1000 * elapsed)
+        logger.info("✅ %s: %.0f ms", name, 1000 * elapsed)
+
+    def warn(self, message):
+        logger.warning("⚠️ %s", message)
+        self.warnings.append(message)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def mark_ready(self):
+        self.phases["total"] = round(1000 * (time.perf_counter() - self._started_at))
+        self._ready.set()
+        logger.info("🚀 Сервер готов за %d ms", self.phases["total"])
+
+    def check(self):
+        if not self.ready:
+            raise NotReadyError()
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "phases_ms": dict(self.phases),
+            "error": str(self.error) if self.error else None,
+            "warnings": list(self.warnings),
+        }
+
+    def run_in_background(self, load, warm_up, retry_delay=10):
+        # Загрузка один раз; прогрев повторяется, пока не пройдёт
+        # (например, пока не поднимется Ollama).
+        def target():
+            try:
+                load()
+            except Exception as e:
+                self.error = e
+                return
+            while True:
+                try:
+                    warm_up()
+                    self.error = None
+                    break
+                except Exception as e:
+                    self.error = e
+                    logger.warning("Прогрев не удался, повтор через %s с: %s", retry_delay, e)
+                    time.sleep(retry_delay)
+            self.mark_ready()
+
+        thread = threading.Thread(target=target, name="startup", daemon=True)
+        thread.start()
+        return thread
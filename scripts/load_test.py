@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+from answer_store import canonical_questions
+from doc_metadata import parse_doc_header
+
+DOCS_DIR = "data/rag_docs"
+ENDPOINTS = {"ask": "/ask", "stream": "/ask/stream"}
+
+
+def corpus_questions(docs_dir, questions_file=None):
+    # Смесь вопросов: типовые вопросы по каждому модулю корпуса и курируемый список
+    questions = []
+    for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.md"), recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        questions.extend(canonical_questions(parse_doc_header(text), text))
+    if questions_file and os.path.exists(questions_file):
+        with open(questions_file, encoding="utf-8") as f:
+            questions.extend(item["question"] if isinstance(item, dict) else item for item in json.load(f))
+    return questions
+
+
+class LoadRun:
+    # Одна ступень нагрузки: либо concurrency клиентов подряд шлют запросы (закрытая модель),
+    # либо запросы приходят с частотой rate в секунду независимо от ответов (открытая модель).
+
+    def __init__(self, client, url, endpoint, questions, mode=None, unique=False, seed=0):
+        self.client = client
+        self.url = url.rstrip("/") + ENDPOINTS[endpoint]
+        self.stream = endpoint == "stream"
+        self.questions = questions
+        self.mode = mode
+        self.unique = unique
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.results = []
+
+    def _body(self):
+        self.sent += 1
+        question = self.random.choice(self.questions)
+        if self.unique:
+            # Уникальный вопрос проходит мимо точного кэша и single-flight
+            # (семантический кэш и хранилище похожие вопросы всё равно находят — см. README)
+            question = f"{question} {self.sent}"
+        body = {"question": question}
+        if self.mode:
+            body["mode"] = self.mode
+        return body
+
+    async def request(self):
+        body = self._body()
+        started = time.perf_counter()
+        result = {"status": None, "error": None, "ttft": None, "source": None}
+        try:
+            if self.stream:
+                async with self.client.stream("POST", self.url, json=body) as response:
+                    result["status"] = response.status_code
+                    event = None
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[7:]
+                            if event == "token" and result["ttft"] is None:
+                                result["ttft"] = time.perf_counter() - started
+                        elif line.startswith("data: ") and event in ("done", "error"):
+                            data = json.loads(line[6:])
+                            result["source"] = data.get("source")
+                            if event == "error":
+                                result["error"] = "stream_error"
+            else:
+                response = await self.client.post(self.url, json=body)
+                result["status"] = response.status_code
+                if response.status_code == 200 and "error" in response.json():
+                    result["error"] = "answer_error"
+                timing = response.headers.get("server-timing", "")
+                if 'desc="' in timing:
+                    result["source"] = timing.rsplit('desc="', 1)[1].rstrip('"')
+            if result["status"] != 200:
+                result["error"] = f"http_{result['status']}"
+        except httpx.HTTPError as e:
+            result["error"] = type(e).__name__
+        result["latency"] = time.perf_counter() - started
+        self.results.append(result)
+
+    async def closed(self, concurrency, duration, max_requests=0):
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline and not (max_requests and self.sent >= max_requests):
+                await self.request()
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+    async def open(self, rate, duration, max_requests=0):
+        # Пуассоновский поток: интервалы между запросами экспоненциальные
+        deadline = time.perf_counter() + duration
+        tasks = []
+        while time.perf_counter() < deadline and not (max_requests and self.sent >= max_requests):
+            tasks.append(asyncio.create_task(self.request()))
+            await asyncio.sleep(self.random.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values) * 1000
+    return {f"p{p}": round(float(np.percentile(values, p)), 1) for p in (50, 95, 99)}
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r["error"] is None]
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": dict(Counter(r["error"] for r in results if r["error"])),
+        "sources": dict(Counter(r["source"] or "-" for r in ok)),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles([r["latency"] for r in ok]),
+        "ttft_ms": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+    }
+
+
+async def run_step(args, questions, level):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        run = LoadRun(client, args.url, args.endpoint, questions, args.mode, args.unique, args.seed)
+        started = time.perf_counter()
+        if args.rate:
+            await run.open(level, args.duration, args.requests)
+        else:
+            await run.closed(int(level), args.duration, args.requests)
+        elapsed = time.perf_counter() - started
+    return summarize(run.results, elapsed)
+
+
+def print_row(kind, level, summary):
+    latency = summary["latency_ms"]
+    ttft = summary["ttft_ms"].get("p95")
+    print(f"{kind}={level:<6} {summary['requests']:>8} {summary['throughput_rps']:>8.2f} "
+          f"{latency.get('p50', 0):>9.0f} {latency.get('p95', 0):>9.0f} {latency.get('p99', 0):>9.0f} "
+          f"{ttft if ttft is not None else '-':>9} {100 * summary['error_rate']:>7.1f}%")
+    # Доля ответов из кэшей и хранилища: при ней насыщение LLM не измеряется
+    print(f"{'':<14} источники: {summary['sources']}")
+    if summary["errors"]:
+        print(f"{'':<14} ошибки: {summary['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /ask: пропускная способность, задержки, ошибки")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Адрес api_server")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="ask")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", default="1,2,4,8",
+                      help="Одновременных клиентов; список через запятую — ступени по очереди")
+    load.add_argument("--rate", help="Запросов в секунду (открытая модель); список — ступени")
+    parser.add_argument("--duration", type=float, default=30, help="Секунд на ступень")
+    parser.add_argument("--requests", type=int, default=0, help="Не больше стольких запросов на ступень")
+    parser.add_argument("--docs", default=DOCS_DIR, help="Документы, из которых берутся вопросы")
+    parser.add_argument("--questions", help="Дополнительные вопросы (JSON-список)")
+    parser.add_argument("--mode", choices=("extractive", "generative", "auto"), help="Режим ответа в запросе")
+    parser.add_argument("--unique", action="store_true", help="Делать вопросы уникальными (мимо точного кэша)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    questions = corpus_questions(args.docs, args.questions)
+    if not questions:
+        parser.error(f"Нет вопросов: в {args.docs} нет документов, --questions не задан")
+    kind, levels = ("rate", args.rate) if args.rate else ("concurrency", args.concurrency)
+    levels = [float(v) if args.rate else int(v) for v in levels.split(",")]
+    print(f"🎯 {args.url}{ENDPOINTS[args.endpoint]}: {len(questions)} вопросов, ступени {kind}={levels}")
+    print(f"{'':<14} {'запросов':>8} {'отв/с':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'ttft p95':>9} {'ошибки':>8}")
+
+    steps = []
+    best = None
+    saturated = None
+    for level in levels:
+        summary = asyncio.run(run_step(args, questions, level))
+        steps.append({kind: level, **summary})
+        print_row(kind, level, summary)
+        # Насыщение: рост нагрузки больше не даёт прироста пропускной способности (>10%)
+        if best is not None and saturated is None and summary["throughput_rps"] < 1.1 * best["throughput_rps"]:
+            saturated = best[kind]
+        if best is None or summary["throughput_rps"] > best["throughput_rps"]:
+            best = steps[-1]
+    if saturated is not None:
+        print(f"📈 Насыщение: после {kind}={saturated} пропускная способность не растёт, "
+              f"максимум {best['throughput_rps']} отв/с при {kind}={best[kind]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"url": args.url, "endpoint": args.endpoint, "mode": args.mode, "unique": args.unique,
+                       "questions": len(questions), "steps": steps}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import re
+
+from langchain_core.documents import Document
+
+_SECTION = re.compile(r"^##\s+")
+# Строки вида «**Ключевые слова**: ...» после секций — отдельные короткие блоки
+_LABEL = re.compile(r"^\*\*(.+?)\*\*:")
+
+
+def section_name(heading):
+    # «## 🩜 Шаги» -> «Шаги»: эмодзи и пробелы в начале заголовка не нужны
+    return re.sub(r"^[^\wа-яА-ЯёЁ]+", "", _SECTION.sub("", heading)).strip()
+
+
+def parse_sections(text):
+    # Документ из json_to_md: шапка до первого «##» и секции.
+    # Возвращает (строки шапки, [(имя секции, строки секции)]).
+    header, sections = [], []
+    current = None
+    for line in text.splitlines():
+        if _SECTION.match(line):
+            current = (section_name(line), [line])
+            sections.append(current)
+        elif current is None:
+            header.append(line)
+        elif _LABEL.match(line):
+            label = _LABEL.match(line).group(1)
+            current = (label, [line])
+            sections.append(current)
+        else:
+            current[1].append(line)
+    header = _strip(header)
+    sections = [(name, _strip(lines)) for name, lines in sections]
+    return header, [(name, lines) for name, lines in sections if lines]
+
+
+def _strip(lines):
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+    while lines and not lines[0].strip():
+        lines = lines[1:]
+    return lines
+
+
+class MarkdownChunker:
+    # Нарезка документов rag_docs по секциям вместо окна 1000/100 символов.
+    # Каждый чанк начинается с заголовка модуля и строки ID, соседние секции
+    # склеиваются, пока влезают в max_tokens токенов модели embedding'ов.
+    # Секция режется (по строкам, с повтором её заголовка) только если сама
+    # не помещается в чанк — так список шагов остаётся целым. Перекрытия нет.
+
+    def __init__(self, count_tokens, max_tokens=256):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+
+    def split_text(self, text):
+        # [(текст чанка, [имена секций])]
+        header, sections = parse_sections(text)
+        # Полная шапка (роли, теги) — в первом чанке, в остальных только название и ID
+        prefix = [line for line in header if line.startswith("# ") or line.startswith("**ID**")]
+        header = self._fit_header(header, prefix)
+        blocks = []
+        for name, lines in sections:
+            blocks.extend((name, part) for part in self._fit_section(lines, prefix))
+
+        chunks = []
+        current, names = list(header), []
+        i = 0
+        while i < len(blocks):
+            name, lines = blocks[i]
+            i += 1
+            candidate = current + [""] + lines
+            if self.count_tokens("\n".join(candidate)) > self.max_tokens:
+                if names:
+                    chunks.append(("\n".join(current), names))
+                    current, names = list(prefix), []
+                else:
+                    # Первый чанк с полной шапкой: блок режется под её бюджет,
+                    # остаток идёт следующими блоками
+                    parts = self._fit_section(lines, header)
+                    if len(parts) > 1 and self.count_tokens("\n".join(current + [""] + parts[0])) <= self.max_tokens:
+                        blocks[i:i] = [(name, part) for part in parts[1:]]
+                        lines = parts[0]
+                    else:
+                        # Рядом с шапкой не помещается даже строка секции — шапка идёт отдельным чанком
+                        chunks.append(("\n".join(current), []))
+                        current = list(prefix)
+                candidate = current + [""] + lines
+            current = candidate
+            if name not in names:
+                names.append(name)
+        if names or not chunks:
+            chunks.append(("\n".join(current), names))
+        return chunks
+
+    def _fit_header(self, header, prefix):
+        # Шапка длиннее чанка (например, очень длинный список ролей) укорачивается
+        # с конца строк вне prefix; роли для фильтра всё равно лежат в метаданных
+        header = list(header)
+        while self.count_tokens("\n".join(header)) > self.max_tokens:
+            longest = max((i for i, line in enumerate(header) if line not in prefix and line.strip()),
+                          key=lambda i: len(header[i]), default=None)
+            if longest is None:
+                break
+            words = header[longest].rstrip(" …").split()
+            header[longest] = " ".join(words[:-1]) + " …" if len(words) > 2 else ""
+        return header
+
+    def _fit_section(self, lines, prefix):
+        # Секция целиком или, если она длиннее чанка, части по строкам;
+        # prefix — строки, с которых начинается чанк (бюджет считается за их вычетом)
+        budget = self.max_tokens - self.count_tokens("\n".join(prefix))
+        if self.count_tokens("\n".join(lines)) <= budget:
+            return [lines]
+        heading, body = lines[0], lines[1:]
+        parts, part = [], [heading]
+        for line in body:
+            if len(part) > 1 and self.count_tokens("\n".join(part + [line])) > budget:
+                parts.append(part)
+                part = [heading]
+            part.append(line)
+        parts.append(part)
+        return parts
+
+    def split_documents(self, docs):
+        chunks = []
+        for doc in docs:
+            for text, names in self.split_text(doc.page_content):
+                metadata = dict(doc.metadata, sections=names, tokens=self.count_tokens(text))
+                chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("uniguide.metrics")
+
+# Этапы запроса в порядке выполнения (для заголовка Server-Timing)
+STAGES = ("queue", "embed", "search", "context", "llm_wait", "llm_prompt", "llm_generate")
+# Корзины гистограмм: секунды этапов, токены prompt, скорость генерации
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 768, 1024, 1536, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+
+# Чужой X-Request-ID принимается, только если он похож на идентификатор
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labels, key)} {_number(v)}" for key, v in sorted(values.items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    # fn — значение на момент опроса: число или {кортеж меток: число}
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.fn is None:
+            return super()._samples()
+        try:
+            value = self.fn()
+        except Exception as e:
+            # Источник ещё не создан (идёт запуск) — метрика просто пропускается
+            logger.debug("gauge %s: %s", self.name, e)
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        return [f"{self.name}{_labels(self.labels, key)} {_number(v)}" for key, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, ('le', _number(bound)))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    # Метрики в текстовом формате Prometheus (без prometheus_client)
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        return self.add(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        return self.add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Trace:
+    # Замеры одного запроса: время этапов конвейера, источник ответа и токены LLM.
+    # Конвейер заполняет его в потоке пула, сервер читает после завершения запроса.
+
+    def __init__(self, request_id=None, endpoint=None):
+        self.request_id = request_id if request_id and _REQUEST_ID.match(request_id) else uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.source = None  # cache / store / extractive / llm
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.tokens_per_second = None
+        self.total = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def record_generation(self, ttft, total, chunks, usage, prompt_tokens=None):
+        # Время prompt и генерации берётся из ответа Ollama, остаток — llm_wait (очередь
+        # внутри Ollama, загрузка модели, сеть). Без этих полей ttft считается обработкой
+        # prompt, остальное — генерацией. Счётчики токенов — тоже из ответа, иначе оценки.
+        if usage.get("eval_duration") is not None:
+            prompt_eval = usage.get("prompt_eval_duration", 0) / 1e9
+            generate = usage["eval_duration"] / 1e9
+            self.add("llm_wait", max(0.0, total - prompt_eval - generate))
+            self.add("llm_prompt", prompt_eval)
+            self.add("llm_generate", generate)
+        else:
+            self.add("llm_prompt", ttft)
+            self.add("llm_generate", total - ttft)
+        self.prompt_tokens = usage.get("prompt_eval_count", prompt_tokens)
+        self.completion_tokens = usage.get("eval_count", chunks)
+        if usage.get("eval_duration"):
+            self.tokens_per_second = usage.get("eval_count", chunks) / (usage["eval_duration"] / 1e9)
+        elif chunks > 1 and total > ttft:
+            self.tokens_per_second = (chunks - 1) / (total - ttft)
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+        return self.total
+
+    def timings_ms(self):
+        ordered = [s for s in STAGES if s in self.stages] + [s for s in self.stages if s not in STAGES]
+        result = {stage: round(1000 * self.stages[stage], 1) for stage in ordered}
+        if self.total is not None:
+            result["total"] = round(1000 * self.total, 1)
+        return result
+
+    def server_timing(self):
+        # Заголовок Server-Timing: "embed;dur=4.1, search;dur=2.3, ..., total;dur=950.0;desc=llm"
+        parts = [f"{stage};dur={ms}" for stage, ms in self.timings_ms().items()]
+        if parts and self.source and self.total is not None:
+            parts[-1] += f';desc="{self.source}"'
+        return ", ".join(parts)
+
+    def headers(self):
+        headers = {"X-Request-ID": self.request_id}
+        timing = self.server_timing()
+        if timing:
+            headers["Server-Timing"] = timing
+        return headers
+
+    def summary(self):
+        return {
+            "request_id": self.request_id,
+            "source": self.source,
+            "timings_ms": self.timings_ms(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second else None,
+        }
+
+
+class RequestMetrics:
+    # Метрики сервера: запросы и ошибки, гистограммы этапов, токены, запросы в работе.
+    # start() открывает Trace запроса, finish() переносит его замеры в метрики.
+
+    def __init__(self, registry=None):
+        self.registry = registry or Registry()
+        r = self.registry
+        self.requests = r.counter("uniguide_requests_total", "Ответы по маршруту и источнику",
+                                  ("endpoint", "source"))
+        self.errors = r.counter("uniguide_errors_total", "Ошибки по маршруту и типу", ("endpoint", "type"))
+        self.in_flight = r.gauge("uniguide_requests_in_flight", "Запросы в обработке", ("endpoint",))
+        self.request_seconds = r.histogram("uniguide_request_seconds", "Время ответа целиком",
+                                           ("endpoint", "source"))
+        self.stage_seconds = r.histogram("uniguide_stage_seconds", "Время этапов конвейера", ("stage",))
+        self.prompt_tokens = r.counter("uniguide_prompt_tokens_total", "Токены prompt, обработанные LLM")
+        self.completion_tokens = r.counter("uniguide_completion_tokens_total", "Токены, сгенерированные LLM")
+        self.prompt_size = r.histogram("uniguide_prompt_tokens", "Размер prompt в токенах",
+                                       buckets=TOKEN_BUCKETS)
+        self.token_rate = r.histogram("uniguide_tokens_per_second", "Скорость генерации, токенов/с",
+                                      buckets=RATE_BUCKETS)
+        self.batch_items = r.counter("uniguide_batch_items_total", "Вопросы пакетных запросов по источнику ответа",
+                                     ("source",))
+
+    def start(self, endpoint, request_id=None):
+        self.in_flight.inc(endpoint=endpoint)
+        return Trace(request_id, endpoint)
+
+    def finish(self, trace, error=None):
+        if trace.total is not None:
+            return
+        total = trace.finish()
+        self.in_flight.dec(endpoint=trace.endpoint)
+        if error is not None:
+            self.errors.inc(endpoint=trace.endpoint, type=type(error).__name__)
+            source = "error"
+        else:
+            # Без источника — запрос получил ответ чужой генерации (single-flight)
+            source = trace.source or "shared"
+        self.requests.inc(endpoint=trace.endpoint, source=source)
+        self.request_seconds.observe(total, endpoint=trace.endpoint, source=source)
+        self.observe(trace)
+        logger.info("request_id=%s %s source=%s %s", trace.request_id, trace.endpoint, source,
+                    trace.server_timing())
+
+    def observe(self, trace):
+        # Этапы и токены без учёта самого запроса (генерации внутри пакета)
+        for stage, seconds in trace.stages.items():
+            self.stage_seconds.observe(seconds, stage=stage)
+        if trace.prompt_tokens:
+            self.prompt_tokens.inc(trace.prompt_tokens)
+            self.prompt_size.observe(trace.prompt_tokens)
+        if trace.completion_tokens:
+            self.completion_tokens.inc(trace.completion_tokens)
+        if trace.tokens_per_second:
+            self.token_rate.observe(trace.tokens_per_second)
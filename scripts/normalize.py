@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+import re
+
+_PUNCT = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    # Ключ для кэшей: регистр, ё/е, пунктуация и лишние пробелы не важны
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("uniguide.llm")
+
+
+# Счётчики из последнего чанка Ollama (длительности — в наносекундах)
+_USAGE_KEYS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+class NoBackendError(Exception):
+    def __init__(self, retry_after=5):
+        super().__init__("Нет доступных серверов Ollama, повторите запрос позже")
+        self.retry_after = retry_after
+
+
+class OllamaBackend:
+    # Один сервер Ollama: постоянный пул HTTP-соединений (keep-alive),
+    # счётчик запросов в работе, задержки и circuit breaker.
+    # keep_alive передаётся в каждом запросе: -1 — модель не выгружается из памяти.
+
+    def __init__(self, url, model, options=None, keep_alive=-1, timeout=120,
+                 max_connections=8, failure_threshold=3, cooldown=30):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.options = options or {}
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None  # время размыкания breaker'а
+        self.probing = False  # в half-open идёт пробный запрос
+        self.model_loaded = None
+        self._ttft = deque(maxlen=256)
+        self._latency = deque(maxlen=256)
+
+    @property
+    def available(self):
+        # Разомкнутый breaker после cooldown (half-open) пропускает один пробный запрос
+        with self._lock:
+            return self.opened_at is None or (
+                not self.probing and time.monotonic() - self.opened_at >= self.cooldown)
+
+    def _acquire(self):
+        # True — запрос пробный (half-open); breaker разомкнут или проба уже идёт — NoBackendError
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                raise NoBackendError(retry_after=self.cooldown)
+            self.probing = True
+            return True
+
+    def _payload(self, prompt, stream):
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": self.options,
+        }
+
+    def _record(self, ok, ttft=None, latency=None):
+        with self._lock:
+            if ok:
+                self.consecutive_failures = 0
+                if self.opened_at is not None:
+                    logger.info("✅ Ollama %s снова доступен", self.url)
+                self.opened_at = None
+                if ttft is not None:
+                    self._ttft.append(ttft)
+                if latency is not None:
+                    self._latency.append(latency)
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("⛔ Ollama %s отключён на %s с после %d ошибок подряд",
+                                   self.url, self.cooldown, self.consecutive_failures)
+                self.opened_at = time.monotonic()
+
+    def stream(self, prompt, usage=None):
+        # usage — необязательный dict: в него пишутся счётчики токенов из последнего чанка
+        probe = self._acquire()
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        started = time.perf_counter()
+        ttft = None
+        try:
+            with self.session.post(f"{self.url}/api/generate", json=self._payload(prompt, True),
+                                   stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    token = chunk.get("response", "")
+                    if token:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        yield token
+                    if chunk.get("done"):
+                        if usage is not None:
+                            usage.update({key: chunk[key] for key in _USAGE_KEYS if key in chunk})
+                        break
+        except GeneratorExit:
+            # Клиент ушёл: соединение закрывается, Ollama прекращает генерацию
+            raise
+        except Exception:
+            self._record(False)
+            raise
+        else:
+            self._record(True, ttft, time.perf_counter() - started)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                if probe:
+                    # Проба закончилась; если клиент ушёл посреди неё, breaker остаётся half-open
+                    self.probing = False
+
+    def check(self):
+        # Проверка здоровья: /api/ps отвечает и модель загружена; если выгружена —
+        # загружаем её заново запросом без prompt (с тем же keep_alive).
+        # Ответ /api/ps breaker не замыкает: сервер может отвечать, а генерация — падать.
+        # Замыкает его только успешная генерация или загрузка модели.
+        try:
+            response = self.session.get(f"{self.url}/api/ps", timeout=5)
+            response.raise_for_status()
+            loaded = {m.get("name") for m in response.json().get("models", [])}
+            self.model_loaded = self.model in loaded
+            if not self.model_loaded:
+                self.pin()
+                self._record(True)
+        except Exception as e:
+            logger.warning("Ollama %s не отвечает: %s", self.url, e)
+            self._record(False)
+            return False
+        return True
+
+    def pin(self):
+        response = self.session.post(
+            f"{self.url}/api/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        self.model_loaded = True
+        logger.info("📌 Модель %s загружена на %s", self.model, self.url)
+
+    def avg_latency(self):
+        with self._lock:
+            return sum(self._latency) / len(self._latency) if self._latency else 0.0
+
+    def stats(self):
+        with self._lock:
+            ttft = sorted(self._ttft)
+            latency = sorted(self._latency)
+            if self.opened_at is None:
+                state = "closed"
+            elif time.monotonic() - self.opened_at >= self.cooldown:
+                state = "half-open"
+            else:
+                state = "open"
+            return {
+                "url": self.url,
+                "model": self.model,
+                "circuit": state,
+                "model_loaded": self.model_loaded,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "failures": self.failures,
+                "ttft_ms_avg": round(1000 * sum(ttft) / len(ttft), 1) if ttft else 0.0,
+                "latency_ms_avg": round(1000 * sum(latency) / len(latency), 1) if latency else 0.0,
+                "latency_ms_p95": round(1000 * latency[int(0.95 * (len(latency) - 1))], 1) if latency else 0.0,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class OllamaPool:
+    # Несколько серверов Ollama за одним интерфейсом invoke/stream (как у LLM langchain).
+    # Запрос уходит на доступный сервер с наименьшим числом запросов в работе;
+    # если сервер упал до первого токена, запрос повторяется на следующем.
+    # Фоновый поток раз в health_interval секунд проверяет серверы и держит модель загруженной.
+
+    def __init__(self, backends, health_interval=10):
+        self.backends = backends
+        self.health_interval = health_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.failovers = 0
+
+    def ensure_available(self):
+        # Быстрый отказ до постановки запроса в очередь, если все серверы отключены
+        available = [b for b in self.backends if b.available]
+        if not available:
+            raise NoBackendError(retry_after=min(b.cooldown for b in self.backends))
+        return available
+
+    def _candidates(self):
+        available = self.ensure_available()
+        # При равной загрузке — сервер с меньшей средней задержкой
+        return sorted(available, key=lambda b: (b.in_flight, b.avg_latency()))
+
+    def stream(self, prompt, usage=None):
+        last_error = None
+        for backend in self._candidates():
+            started = False
+            try:
+                for token in backend.stream(prompt, usage):
+                    started = True
+                    yield token
+                return
+            except NoBackendError as e:
+                # Breaker разомкнулся или пробный запрос уже занят другим потоком
+                last_error = e
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+                with self._lock:
+                    self.failovers += 1
+                logger.warning("Ollama %s: %s, пробуем следующий сервер", backend.url, e)
+        raise last_error
+
+    def invoke(self, prompt, usage=None):
+        return "".join(self.stream(prompt, usage))
+
+    def check(self):
+        for backend in self.backends:
+            backend.check()
+
+    def start(self):
+        # Первая проверка сразу загружает модель на всех серверах
+        def loop():
+            while not self._stop.is_set():
+                self.check()
+                self._stop.wait(self.health_interval)
+
+        self._thread = threading.Thread(target=loop, name="ollama-health", daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        return {
+            "failovers": self.failovers,
+            "backends": [b.stats() for b in self.backends],
+        }
+
+    def close(self):
+        self._stop.set()
+        for backend in self.backends:
+            backend.close()
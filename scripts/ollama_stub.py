@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from token_count import approx_tokens
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # Минимальная замена Ollama для проверок и нагрузочных тестов без модели:
+    # /api/generate отдаёт NDJSON-поток из слов фиксированного ответа, /api/ps и /api/tags —
+    # список моделей. Стоимость prompt, скорость токенов, число параллельных генераций
+    # и доля отказов настраиваются (см. make_server).
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path in ("/api/ps", "/api/tags"):
+            models = [{"name": m, "model": m} for m in sorted(self.server.loaded)]
+            self._json(200, {"models": models})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "")
+        with self.server.lock:
+            self.server.requests += 1
+        self.server.loaded.add(model)
+        if not request.get("prompt"):
+            # Запрос без prompt только загружает модель
+            self._json(200, {"model": model, "response": "", "done": True})
+            return
+        if self.server.roll(self.server.fail_rate):
+            with self.server.lock:
+                self.server.failed += 1
+            self._json(500, {"error": "injected failure"})
+            return
+
+        # Как у Ollama на CPU: генераций одновременно не больше parallel, остальные ждут
+        started = time.perf_counter()
+        with self.server.slots:
+            with self.server.lock:
+                self.server.active += 1
+            try:
+                self._generate(request, model, started)
+            finally:
+                with self.server.lock:
+                    self.server.active -= 1
+
+    def _generate(self, request, model, started):
+        server = self.server
+        prompt_tokens = approx_tokens(request["prompt"])
+        prompt_started = time.perf_counter()
+        time.sleep(server.prompt_cost * prompt_tokens)
+        prompt_eval = time.perf_counter() - prompt_started
+        words = server.words()
+        usage = {"prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_eval * 1e9)}
+
+        if not request.get("stream", True):
+            eval_started = time.perf_counter()
+            time.sleep(server.delay * len(words))
+            self._json(200, {"model": model, "response": " ".join(words), "done": True, **usage,
+                             **self._eval_usage(len(words), eval_started, started)})
+            return
+        # Обрыв потока посреди генерации: сервер закрывает соединение без done
+        cut_at = max(1, len(words) // 2) if server.roll(server.drop_rate) else None
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            eval_started = time.perf_counter()
+            for i, word in enumerate(words):
+                if i == cut_at:
+                    with server.lock:
+                        server.dropped += 1
+                    self.close_connection = True
+                    return
+                time.sleep(server.delay)
+                self._chunk({"model": model, "response": word if i == 0 else " " + word, "done": False})
+            self._chunk({"model": model, "response": "", "done": True, **usage,
+                         **self._eval_usage(len(words), eval_started, started)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    @staticmethod
+    def _eval_usage(count, eval_started, started):
+        now = time.perf_counter()
+        return {"eval_count": count, "eval_duration": int((now - eval_started) * 1e9),
+                "total_duration": int((now - started) * 1e9)}
+
+    def _chunk(self, data):
+        line = json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def words(self):
+        # Ответ из слов answer, повторённых до answer_tokens (0 — ответ как есть)
+        words = self.answer.split()
+        if self.answer_tokens:
+            words = [words[i % len(words)] for i in range(self.answer_tokens)]
+        return words
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "active": self.active,
+                    "failed": self.failed, "dropped": self.dropped}
+
+
+def make_server(host="127.0.0.1", port=11500, answer="Ответ тестового сервера.", delay=0.01,
+                prompt_cost=0.0, answer_tokens=0, parallel=0, fail_rate=0.0, drop_rate=0.0, seed=None):
+    # port=0 — свободный порт, он доступен как server.server_address[1].
+    # delay — секунд на токен ответа, prompt_cost — секунд на токен prompt,
+    # parallel — одновременных генераций (0 — без ограничения),
+    # fail_rate — доля ответов 500, drop_rate — доля потоков, оборванных посреди ответа.
+    server = StubOllamaServer((host, port), StubOllamaHandler)
+    server.answer = answer
+    server.delay = delay
+    server.prompt_cost = prompt_cost
+    server.answer_tokens = answer_tokens
+    server.fail_rate = fail_rate
+    server.drop_rate = drop_rate
+    server.slots = threading.BoundedSemaphore(parallel) if parallel else nullcontext()
+    server.random = random.Random(seed)
+    server.loaded = set()
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.active = 0
+    server.failed = 0
+    server.dropped = 0
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Ollama API для проверок без модели")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--answer", default="Ответ тестового сервера.", help="Текст, который отдаётся на любой prompt")
+    parser.add_argument("--delay-ms", type=float, default=10, help="Задержка перед каждым токеном")
+    parser.add_argument("--token-rate", type=float, default=0,
+                        help="Токенов ответа в секунду (вместо --delay-ms)")
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0,
+                        help="Обработка prompt: мс на токен (Mistral 7B Q4 на CPU — порядка 5–20)")
+    parser.add_argument("--answer-tokens", type=int, default=0, help="Длина ответа в словах (0 — как --answer)")
+    parser.add_argument("--parallel", type=int, default=0,
+                        help="Одновременных генераций, как OLLAMA_NUM_PARALLEL (0 — без ограничения)")
+    parser.add_argument("--fail-rate", type=float, default=0, help="Доля запросов с ошибкой 500")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Доля потоков, оборванных посреди ответа")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    server = make_server(
+        args.host, args.port, args.answer,
+        delay=1 / args.token_rate if args.token_rate else args.delay_ms / 1000,
+        prompt_cost=args.prompt_ms_per_token / 1000, answer_tokens=args.answer_tokens,
+        parallel=args.parallel, fail_rate=args.fail_rate, drop_rate=args.drop_rate, seed=args.seed,
+    )
+    print(f"🧪 Заглушка Ollama: http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from normalize import normalize_query
+
+
+class CachedEmbeddings(Embeddings):
+    # Обёртка над любым Embeddings: кэширует embed_query по нормализованному
+    # тексту вопроса. Память ограничена max_bytes (LRU), при заданном
+    # db_path вектора дополнительно сохраняются в SQLite и переживают рестарт.
+    # embed_documents (индексация) проходит без кэша.
+    # embed_queries — пачка вопросов: кэш проверяется для каждого, промахи
+    # кодируются одним embed_documents.
+
+    def __init__(self, inner, max_bytes=64 * 1024 * 1024, db_path=None, namespace=None):
+        self.inner = inner
+        self.max_bytes = max_bytes
+        # Вектора разных моделей не должны смешиваться в одном файле
+        self.namespace = namespace or getattr(inner, "model_name", None) or type(inner).__name__
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> np.float32 vector
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "namespace TEXT, key TEXT, vector BLOB, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+            vector = self._load(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return vector.tolist()
+            self.misses += 1
+
+        vector = np.asarray(self.inner.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            self._store(key, vector)
+        return vector.tolist()
+
+    def embed_queries(self, texts):
+        keys = [normalize_query(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    vector = self._load(key)
+                    if vector is not None:
+                        self.disk_hits += 1
+                        self._remember(key, vector)
+                if vector is not None:
+                    vectors[i] = vector
+                elif key not in missing:
+                    self.misses += 1
+                    missing[key] = texts[i]
+        if missing:
+            encoded = self.inner.embed_documents(list(missing.values()))
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    missing[key] = vector
+                    self._remember(key, vector)
+                    self._store(key, vector)
+        return [(vector if vector is not None else missing[key]).tolist() for vector, key in zip(vectors, keys)]
+
+    def _remember(self, key, vector):
+        if key in self._entries:
+            return
+        self._entries[key] = vector
+        self._bytes += _entry_size(key, vector)
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old_vector = self._entries.popitem(last=False)
+            self._bytes -= _entry_size(old_key, old_vector)
+
+    def _load(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT vector FROM query_embeddings WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def _store(self, key, vector):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+            (self.namespace, key, vector.tobytes()),
+        )
+        self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "persistent": self._db is not None,
+            }
+
+
+def _entry_size(key, vector):
+    return vector.nbytes + sys.getsizeof(key)
+
+
+def cached_embeddings(inner, namespace=None):
+    # Настройки из окружения, одинаковые для api_server, rag_ask и test_rag_bot
+    return CachedEmbeddings(
+        inner,
+        max_bytes=int(float(os.environ.get("UNIGUIDE_EMBED_CACHE_MB", "64")) * 1024 * 1024),
+        db_path=os.environ.get("UNIGUIDE_EMBED_CACHE_DB") or None,
+        namespace=namespace,
+    )
@@ -8,13 +8,16 @@ from langchain_core.documents import Document
 
 import re
 
+from index_store import resolve_index_path
+from query_embed_cache import cached_embeddings
+
 # 1. Загружаем embedding
 print("🤖 Загружаем MiniLM embedding...")
-embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embedding = cached_embeddings(HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"))
 
 # 2. Загружаем FAISS индекс
 print("📂 Загружаем FAISS индекс...")
-db = FAISS.load_local("faiss_index", embedding, allow_dangerous_deserialization=True)
+db = FAISS.load_local(resolve_index_path("faiss_index"), embedding, allow_dangerous_deserialization=True)
 
 # 3. Настраиваем LLM
 llm = Ollama(model="mistral")
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain.prompts import PromptTemplate
+
+from lexical_index import rrf_fuse
+from doc_metadata import normalize_label
+from index_types import search_parameters
+from metrics import Trace
+from normalize import normalize_query
+
+logger = logging.getLogger("uniguide.pipeline")
+
+# Prompt system
+system_prompt = """
+Ты — интеллектуальный помощник пользователей системы UNIVER.
+Отвечай только на русском языке. Отвечай кратко, чётко и по делу.
+Используй только приведённый ниже контекст. Не выдумывай.
+Обязательно используй термины, встречающиеся в вопросе.
+"""
+
+prompt_template = PromptTemplate(
+    input_variables=["context", "question"],
+    template=system_prompt + "\n\nКонтекст:\n{context}\n\nВопрос: {question}\nОтвет:"
+)
+
+# Вопрос внутри диалога: перед вопросом — сжатая история (sessions.SessionStore)
+chat_prompt_template = PromptTemplate(
+    input_variables=["context", "history", "question"],
+    template=system_prompt + "\n\nКонтекст:\n{context}\n\nИстория диалога:\n{history}\n\nВопрос: {question}\nОтвет:"
+)
+
+
+# Ответ, когда фильтр роли и модуля не оставил ни одного чанка: без контекста LLM
+# ответила бы «из головы», поэтому генерация не запускается
+NO_DOCS_ANSWER = "По выбранной роли и модулю документов не найдено."
+
+
+def batch_item(item, mode="generative"):
+    # Строка или {"question", "role", "module", "mode"} -> (вопрос, роль, модуль, режим)
+    if isinstance(item, str):
+        return item, None, None, mode
+    return item["question"], item.get("role"), item.get("module"), item.get("mode") or mode
+
+
+def filter_scope(role=None, module=None):
+    # Строка фильтра для ключей кэша; None — без фильтра
+    if not role and not module:
+        return None
+    return f"{normalize_label(role or '')}:{normalize_label(module or '')}"
+
+
+def cache_key(question, role=None, module=None):
+    # Ключ точного кэша ответов: нормализованный вопрос и фильтр
+    scope = filter_scope(role, module)
+    return f"{scope}|{normalize_query(question)}" if scope else normalize_query(question)
+
+
+class RagPipeline:
+    # Те же шаги, что у RetrievalQA + StuffDocumentsChain, но разделённые на стадии,
+    # чтобы генерацию можно было отдавать потоком токенов.
+    # cache — необязательный AnswerCache перед LLM.
+    # lexical — необязательный BM25Index: тогда поиск гибридный, FAISS и BM25
+    # выдают по fetch_k кандидатов, которые сливаются через reciprocal rank fusion.
+    # reranker — необязательный Reranker: из поиска берётся rerank_candidates чанков,
+    # а в prompt попадают те, что он отобрал (вместо первых k).
+    # metadata — необязательный MetadataIndex: поиск по роли и модулю идёт
+    # только среди разрешённых векторов (фильтр внутри FAISS и BM25).
+    # assembler — необязательный ContextAssembler: контекст собирается в бюджет
+    # токенов LLM без повторов, а размер prompt пишется в лог вместе со временем генерации.
+    # store — необязательный AnswerStore: готовые ответы на типовые вопросы, без поиска и LLM.
+    # extractive — необязательный ExtractiveAnswerer: шаги модуля вместо генерации
+    # (mode="extractive" всегда, mode="auto" — если поиск уверен в модуле).
+    # index_version — версия индекса db: с ней ответы кладутся в кэш, и кэш отбрасывает
+    # ответы старого pipeline, дописанные после переключения индекса.
+
+    def __init__(self, db, llm, k=2, cache=None, lexical=None, fetch_k=10,
+                 reranker=None, rerank_candidates=8, metadata=None, assembler=None, store=None,
+                 extractive=None, index_version=None):
+        self.db = db
+        self.llm = llm
+        self.k = k
+        self.cache = cache
+        self.lexical = lexical
+        self.fetch_k = fetch_k
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.metadata = metadata
+        self.assembler = assembler
+        self.store = store
+        self.extractive = extractive
+        self.index_version = index_version
+
+    def embed(self, question):
+        return self.db.embedding_function.embed_query(question)
+
+    def doc_at(self, position):
+        return self.db.docstore.search(self.db.index_to_docstore_id[position])
+
+    def dense_hits(self, vector, k, selector=None):
+        # [(позиция, L2-расстояние)] по возрастанию расстояния
+        params = search_parameters(self.db.index, selector) if selector is not None else None
+        distances, positions = self.db.index.search(np.asarray([vector], dtype=np.float32), k, params=params)
+        return [(int(p), float(d)) for p, d in zip(positions[0], distances[0]) if p != -1]
+
+    def dense_hits_batch(self, vectors, k, selector=None):
+        # То же для пачки векторов одним index.search
+        params = search_parameters(self.db.index, selector) if selector is not None else None
+        distances, positions = self.db.index.search(np.asarray(vectors, dtype=np.float32), k, params=params)
+        return [[(int(p), float(d)) for p, d in zip(row_positions, row_distances) if p != -1]
+                for row_positions, row_distances in zip(positions, distances)]
+
+    def dense_search(self, vector, k, selector=None):
+        return [p for p, _ in self.dense_hits(vector, k, selector)]
+
+    def _filter(self, role, module):
+        # (разрешённые позиции, IDSelector) или (None, None) без фильтра
+        if self.metadata is None:
+            return None, None
+        return self.metadata.selector(role, module) or (None, None)
+
+    def candidates(self, question, vector, n, role=None, module=None):
+        allowed, selector = self._filter(role, module)
+        if allowed is not None and not allowed:
+            return []
+        if self.lexical is None:
+            if selector is None:
+                return self.db.similarity_search_by_vector(vector, k=n)
+            return [self.doc_at(p) for p in self.dense_search(vector, n, selector)]
+        dense = self.dense_search(vector, max(n, self.fetch_k), selector)
+        return self._fuse(question, dense, n, allowed)
+
+    def _fuse(self, question, dense, n, allowed=None):
+        fetch_k = max(n, self.fetch_k)
+        lexical = [position for position, _ in self.lexical.search(question, fetch_k, allowed=allowed)]
+        return [self.doc_at(p) for p in rrf_fuse([dense[:fetch_k], lexical])[:n]]
+
+    def retrieve(self, question, vector=None, role=None, module=None):
+        if vector is None:
+            vector = self.embed(question)
+        if self.reranker is None:
+            return self.candidates(question, vector, self.k, role, module)
+        docs = self.candidates(question, vector, self.rerank_candidates, role, module)
+        return self.reranker.rerank(question, docs)
+
+    def build_prompt(self, question, docs, history=None):
+        return self._prompt(question, docs, history)[0]
+
+    def _prompt(self, question, docs, history=None):
+        # (prompt, число токенов prompt или None без assembler)
+        if self.assembler is None:
+            context = "\n\n".join(doc.page_content for doc in docs)
+        else:
+            context, _ = self.assembler.assemble(docs)
+        if history:
+            prompt = chat_prompt_template.format(context=context, history=history, question=question)
+        else:
+            prompt = prompt_template.format(context=context, question=question)
+        if self.assembler is None:
+            return prompt, None
+        return prompt, self.assembler.record_prompt(prompt)
+
+    def extract(self, vector, role=None, module=None, mode="auto"):
+        # Ответ из шагов модуля лучшего чанка или None
+        allowed, selector = self._filter(role, module)
+        hits = []
+        if allowed is None or allowed:
+            hits = self.dense_hits(vector, self.fetch_k, selector)
+        return self.extractive.answer(self._module_hits(hits), mode)
+
+    def _module_hits(self, hits):
+        # [(позиция, расстояние)] -> [(модуль чанка, расстояние)]
+        result = []
+        for position, distance in hits:
+            meta = self.doc_at(position).metadata
+            result.append((meta.get("module_id") or meta.get("doc_id"), distance))
+        return result
+
+    def _fast_path(self, question, role=None, module=None, mode="generative", trace=None):
+        # Возвращает (ответ без генерации либо None, ключ, embedding запроса).
+        # В режиме extractive кэш и хранилище не используются: там ответы LLM.
+        scope = filter_scope(role, module)
+        key = cache_key(question, role, module)
+        use_cache = self.cache is not None and mode != "extractive"
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                trace.source = "cache"
+                return cached, key, None
+        with trace.stage("embed"):
+            vector = self.embed(question)
+        if self.store is not None and mode != "extractive":
+            stored = self.store.match(vector, role, module)
+            if stored is not None:
+                trace.source = "store"
+                return stored, key, vector
+        if use_cache:
+            cached = self.cache.get_similar(vector, scope)
+            if cached is not None:
+                trace.source = "cache"
+                return cached, key, vector
+        if self.extractive is not None:
+            if mode == "generative":
+                self.extractive.record(mode, False)
+            else:
+                with trace.stage("search"):
+                    extracted = self.extract(vector, role, module, mode)
+                if extracted is not None:
+                    trace.source = "extractive"
+                    return extracted, key, vector
+        return None, key, vector
+
+    def _generation_prompt(self, question, vector, role, module, trace, history=None):
+        # (prompt, токены) или (None, None), если поиск не нашёл документов
+        with trace.stage("search"):
+            docs = self.retrieve(question, vector, role, module)
+        if not docs:
+            return None, None
+        with trace.stage("context"):
+            return self._prompt(question, docs, history)
+
+    def answer(self, question, role=None, module=None, mode="generative", trace=None, history=None):
+        return "".join(self.stream(question, role, module, mode, trace, history))
+
+    def stream(self, question, role=None, module=None, mode="generative", trace=None, history=None):
+        # trace — необязательный metrics.Trace: в него пишутся время этапов и токены.
+        # history — необязательная история диалога для prompt; question тогда — уже
+        # самостоятельный запрос (SessionStore.condense), по нему идут поиск и кэш.
+        trace = trace if trace is not None else Trace()
+        yield from self.stream_plan(self.plan(question, role, module, mode, trace, history), trace)
+
+    def plan(self, question, role=None, module=None, mode="generative", trace=None, history=None):
+        # Всё до генерации: кэш, хранилище, быстрый ответ, поиск и prompt.
+        # План — как у plan_batch: {"answer", "source"} либо {"prompt", ...} для stream_plan().
+        # Сервер выполняет план и генерацию в разных пулах, чтобы быстрые ответы
+        # не ждали чужих генераций.
+        trace = trace if trace is not None else Trace()
+        # Ожидание в очереди пула: план начинается, когда поток взял задачу
+        trace.add("queue", time.perf_counter() - trace.started)
+        cached, key, vector = self._fast_path(question, role, module, mode, trace)
+        # Ответ с учётом истории в общий кэш не кладётся: другим он может не подойти
+        plan = {"question": question, "key": None if history else key, "vector": vector,
+                "scope": filter_scope(role, module), "answer": cached, "source": trace.source}
+        if cached is not None:
+            return plan
+        prompt, tokens = self._generation_prompt(question, vector, role, module, trace, history)
+        if prompt is None:
+            plan.update(answer=NO_DOCS_ANSWER, source="no_docs")
+        else:
+            plan.update(prompt=prompt, tokens=tokens)
+        return plan
+
+    def _generate(self, prompt, tokens, key, vector, scope, trace):
+        trace.source = "llm"
+        parts = []
+        usage = {}
+        started = time.perf_counter()
+        ttft = None
+        for token in self.llm.stream(prompt, usage=usage):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(token)
+            yield token
+        total = time.perf_counter() - started
+        trace.record_generation(ttft or total, total, len(parts), usage, tokens)
+        if tokens is not None:
+            # Время до первого токена на CPU почти целиком — обработка prompt
+            logger.info("prompt_tokens=%d ttft=%.0f ms generation=%.0f ms",
+                        tokens, 1000 * (ttft or total), 1000 * total)
+        # В кэш попадает только полностью сгенерированный ответ
+        if self.cache is not None and key is not None:
+            self.cache.put(key, vector, "".join(parts), scope, version=self.index_version)
+
+    def embed_batch(self, questions):
+        # Все вопросы одним проходом модели; CachedEmbeddings ещё и берёт известные из кэша
+        embedding = self.db.embedding_function
+        embed = getattr(embedding, "embed_queries", None) or embedding.embed_documents
+        return embed(questions)
+
+    def plan_batch(self, items, trace=None):
+        # items — [(вопрос, роль, модуль, режим)]. Для каждого вопроса — план:
+        # {"answer", "source"} — ответ без LLM, иначе {"prompt", ...} для stream_plan().
+        # Embedding'и всех вопросов считаются одним проходом, поиск — одним index.search
+        # на каждый набор фильтров. Одинаковые вопросы получают один и тот же план.
+        trace = trace if trace is not None else Trace()
+        shared = {}
+        plans = []
+        for question, role, module, mode in items:
+            key = cache_key(question, role, module)
+            plan = shared.get((key, mode))
+            if plan is None:
+                plan = shared[(key, mode)] = {
+                    "question": question, "role": role, "module": module, "mode": mode,
+                    "key": key, "scope": filter_scope(role, module), "answer": None, "source": None,
+                }
+            plans.append(plan)
+
+        todo = []
+        for plan in shared.values():
+            cached = self.cache.get(plan["key"]) if self._use_cache(plan) else None
+            if cached is not None:
+                plan.update(answer=cached, source="cache")
+            else:
+                todo.append(plan)
+        if not todo:
+            return plans
+        with trace.stage("embed"):
+            vectors = self.embed_batch([plan["question"] for plan in todo])
+
+        search = []
+        for plan, vector in zip(todo, vectors):
+            plan["vector"] = vector
+            answer, source = None, None
+            if self.store is not None and plan["mode"] != "extractive":
+                answer, source = self.store.match(vector, plan["role"], plan["module"]), "store"
+            if answer is None and self._use_cache(plan):
+                answer, source = self.cache.get_similar(vector, plan["scope"]), "cache"
+            if answer is None:
+                search.append(plan)
+            else:
+                plan.update(answer=answer, source=source)
+
+        with trace.stage("search"):
+            results = self._batch_hits(search)
+        for plan, (hits, allowed) in zip(search, results):
+            if self.extractive is not None:
+                if plan["mode"] == "generative":
+                    self.extractive.record(plan["mode"], False)
+                else:
+                    with trace.stage("search"):
+                        extracted = self.extractive.answer(self._module_hits(hits[:self.fetch_k]), plan["mode"])
+                    if extracted is not None:
+                        plan.update(answer=extracted, source="extractive")
+                        continue
+            with trace.stage("search"):
+                docs = self._docs_from_hits(plan["question"], hits, allowed)
+            if not docs:
+                plan.update(answer=NO_DOCS_ANSWER, source="no_docs")
+                continue
+            with trace.stage("context"):
+                plan["prompt"], plan["tokens"] = self._prompt(plan["question"], docs)
+        return plans
+
+    def _use_cache(self, plan):
+        return self.cache is not None and plan["mode"] != "extractive"
+
+    def _batch_hits(self, plans):
+        # [(hits, разрешённые позиции)] на каждый план; вопросы с одинаковым фильтром
+        # ищутся одним index.search
+        k = max(self.k, self.fetch_k, self.rerank_candidates if self.reranker is not None else 0)
+        groups = {}
+        for i, plan in enumerate(plans):
+            groups.setdefault(plan["scope"], []).append(i)
+        results = [None] * len(plans)
+        for indices in groups.values():
+            first = plans[indices[0]]
+            allowed, selector = self._filter(first["role"], first["module"])
+            if allowed is not None and not allowed:
+                for i in indices:
+                    results[i] = ([], allowed)
+                continue
+            rows = self.dense_hits_batch([plans[i]["vector"] for i in indices], k, selector)
+            for i, hits in zip(indices, rows):
+                results[i] = (hits, allowed)
+        return results
+
+    def _docs_from_hits(self, question, hits, allowed):
+        # Те же кандидаты, что у retrieve(), но из готовых результатов FAISS
+        n = self.rerank_candidates if self.reranker is not None else self.k
+        if allowed is not None and not allowed:
+            docs = []
+        elif self.lexical is None:
+            docs = [self.doc_at(p) for p, _ in hits[:n]]
+        else:
+            docs = self._fuse(question, [p for p, _ in hits], n, allowed)
+        if self.reranker is None:
+            return docs
+        return self.reranker.rerank(question, docs)
+
+    def stream_plan(self, plan, trace=None, queued_at=None):
+        # Генерация по плану из plan() или plan_batch(); ответ кладётся в кэш.
+        # queued_at — когда генерация встала в очередь (ожидание идёт в этап queue)
+        trace = trace if trace is not None else Trace()
+        if queued_at is not None:
+            trace.add("queue", time.perf_counter() - queued_at)
+        if plan["answer"] is not None:
+            trace.source = plan["source"]
+            yield plan["answer"]
+            return
+        yield from self._generate(plan["prompt"], plan["tokens"], plan["key"], plan["vector"], plan["scope"], trace)
+
+    def answer_batch(self, items, mode="generative", max_concurrency=2):
+        # Пачка вопросов: строки или {"question", "role", "module", "mode"}.
+        # Генерации идут не более чем в max_concurrency потоков.
+        # Результаты в порядке вопросов: {"answer", "source"} или {"error"}.
+        items = [batch_item(item, mode) for item in items]
+        plans = self.plan_batch(items)
+        unique = {id(plan): plan for plan in plans if plan["answer"] is None}
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = {key: executor.submit(lambda p: "".join(self.stream_plan(p)), plan)
+                       for key, plan in unique.items()}
+        results = []
+        for plan in plans:
+            if plan["answer"] is not None:
+                results.append({"answer": plan["answer"], "source": plan["source"]})
+                continue
+            try:
+                results.append({"answer": futures[id(plan)].result(), "source": "llm"})
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+import threading
+import time
+
+from token_count import approx_tokens
+
+logger = logging.getLogger("uniguide.rerank")
+
+_WORD = re.compile(r"[а-яёa-z0-9]+", re.IGNORECASE)
+
+
+class Reranker:
+    # Переранжирование кандидатов перед LLM. Если задан model_name — небольшой
+    # CPU cross-encoder, иначе дешёвая оценка по пересечению слов (лемм) с вопросом.
+    # Если оценка не укладывается в time_budget секунд, используется исходный
+    # порядок поиска. В prompt уходят лучшие чанки, влезающие в token_budget.
+
+    def __init__(self, model_name=None, token_budget=800, time_budget=0.15,
+                 max_chunks=4, batch_size=4, lemmatizer=None, count_tokens=approx_tokens):
+        self.model = None
+        if model_name:
+            from sentence_transformers import CrossEncoder
+
+            self.model = CrossEncoder(model_name, device="cpu")
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.max_chunks = max_chunks
+        self.batch_size = batch_size
+        self.lemmatizer = lemmatizer
+        self.count_tokens = count_tokens
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.fallbacks = 0
+
+    def _words(self, text):
+        if self.lemmatizer is not None:
+            return set(self.lemmatizer.tokens(text))
+        return {w.lower().replace("ё", "е") for w in _WORD.findall(text)}
+
+    def _overlap_scores(self, question, docs, deadline):
+        query = self._words(question)
+        scores = []
+        for doc in docs:
+            if time.perf_counter() > deadline:
+                return None
+            words = self._words(doc.page_content)
+            scores.append(len(query & words) / (len(query) or 1))
+        return scores
+
+    def _model_scores(self, question, docs, deadline):
+        scores = []
+        for start in range(0, len(docs), self.batch_size):
+            if time.perf_counter() > deadline:
+                return None
+            batch = docs[start:start + self.batch_size]
+            scores.extend(float(s) for s in self.model.predict([(question, d.page_content) for d in batch]))
+        if time.perf_counter() > deadline:
+            return None
+        return scores
+
+    def _fit_budget(self, docs):
+        selected, used = [], 0
+        for doc in docs:
+            tokens = self.count_tokens(doc.page_content)
+            if selected and (used + tokens > self.token_budget or len(selected) >= self.max_chunks):
+                break
+            selected.append(doc)
+            used += tokens
+        return selected
+
+    def rerank(self, question, docs):
+        deadline = time.perf_counter() + self.time_budget
+        if self.model is not None:
+            scores = self._model_scores(question, docs, deadline)
+        else:
+            scores = self._overlap_scores(question, docs, deadline)
+
+        with self._lock:
+            self.calls += 1
+            if scores is None:
+                self.fallbacks += 1
+        if scores is None:
+            logger.warning(
+                "Переранжирование не уложилось в %.0f ms, исходный порядок (%d из %d запросов)",
+                1000 * self.time_budget, self.fallbacks, self.calls,
+            )
+            return self._fit_budget(docs)
+
+        # sorted устойчива: при равных оценках сохраняется порядок поиска
+        order = sorted(range(len(docs)), key=lambda i: -scores[i])
+        return self._fit_budget([docs[i] for i in order])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scorer": "cross-encoder" if self.model is not None else "lexical-overlap",
+                "calls": self.calls,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": round(self.fallbacks / self.calls, 3) if self.calls else 0.0,
+                "token_budget": self.token_budget,
+                "time_budget_ms": round(1000 * self.time_budget),
+            }
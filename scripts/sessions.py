@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from token_count import approx_tokens
+
+# ID сессии приходит от клиента (виджет хранит его в sessionStorage); проверяется в модели запроса
+SESSION_ID_PATTERN = r"^[A-Za-z0-9._-]{8,64}$"
+_WORD = re.compile(r"[а-яёa-z0-9]+", re.IGNORECASE)
+# Слова, по которым вопрос ссылается на предыдущий: «а как его отменить?», «а где это?»
+_ANAPHORA = {
+    "его", "её", "ее", "их", "него", "неё", "нее", "них", "ему", "ей", "им", "нему", "ней", "ним",
+    "он", "она", "оно", "они", "это", "этого", "этому", "этом", "этот", "эта", "эту", "эти", "этих",
+    "тот", "того", "там", "туда", "оттуда", "тогда",
+}
+_FOLLOW_UP_START = ("а ", "и ", "а если", "а что", "ещё", "еще", "также", "тоже")
+# Служебные слова не считаются содержательными
+_STOP_WORDS = {
+    "а", "и", "как", "где", "что", "когда", "можно", "ли", "нужно", "мне", "я", "в", "на", "с",
+    "по", "для", "не", "ну", "же", "бы", "или", "да", "нет", "кто", "куда", "зачем", "почему",
+}
+
+
+def is_follow_up(question):
+    # Уточнение без собственной темы: начинается с «а …», ссылается местоимением
+    # или не содержит содержательных слов («почему?», «как?»)
+    text = question.strip().lower()
+    words = _WORD.findall(text)
+    if text.startswith(_FOLLOW_UP_START) or _ANAPHORA.intersection(words):
+        return True
+    return not [w for w in words if w not in _STOP_WORDS]
+
+
+def condense_question(question, topic):
+    # Самостоятельный запрос для поиска: тема диалога (последний самостоятельный вопрос)
+    # + уточнение. Без LLM: лишняя генерация на CPU стоила бы секунды на каждый вопрос.
+    if not topic or not is_follow_up(question):
+        return question
+    return f"{topic.rstrip(' ?.!')}: {question.strip()}"
+
+
+def truncate_tokens(text, max_tokens, count_tokens=approx_tokens):
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    words = text.split()
+    keep = max(1, int(len(words) * max_tokens / tokens))
+    while keep > 1 and count_tokens(" ".join(words[:keep]) + " …") > max_tokens:
+        keep -= 1
+    return " ".join(words[:keep]) + " …"
+
+
+class ChatSession:
+    # Диалог одного пользователя: последние ходы целиком (ответ урезан), более ранние —
+    # только вопросы; topic — последний самостоятельный вопрос, к нему достраиваются уточнения
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.turns = []  # [(вопрос, ответ)]
+        self.earlier = []  # вопросы ходов, вытесненных из turns
+        self.topic = None
+        self.created_at = time.time()
+        self.last_seen = self.created_at
+        self.requests = 0
+        self.bytes = 0
+
+    def size(self):
+        # Оценка памяти сессии: строки ходов и служебные поля
+        strings = [text for turn in self.turns for text in turn] + self.earlier + [self.topic or "", self.id]
+        return sys.getsizeof(self) + sum(sys.getsizeof(s) for s in strings) + 64 * len(self.turns)
+
+
+class SessionStore:
+    # Сессии диалога в памяти процесса. Память ограничена max_bytes: при переполнении
+    # вытесняются давно не активные сессии (LRU); сессии без запросов дольше idle_ttl
+    # секунд удаляются. История для prompt укладывается в history_tokens токенов:
+    # новые ходы целиком, старые — строкой «Ранее спрашивали: …».
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, idle_ttl=1800, history_tokens=300,
+                 answer_tokens=120, max_turns=6, max_earlier=5, count_tokens=approx_tokens):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.history_tokens = history_tokens
+        self.answer_tokens = answer_tokens
+        self.max_turns = max_turns
+        self.max_earlier = max_earlier
+        self.count_tokens = count_tokens
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # id -> ChatSession, давно активные в начале
+        self._bytes = 0
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_memory = 0
+        self.condensed = 0
+
+    def _evict_idle(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen <= self.idle_ttl:
+                break
+            self._remove(session.id)
+            self.evicted_idle += 1
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.bytes
+        return session
+
+    def _touch(self, session_id):
+        now = time.time()
+        self._evict_idle(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id)
+            session.bytes = session.size()
+            self._sessions[session_id] = session
+            self._bytes += session.bytes
+            self.created += 1
+        self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        return session
+
+    def prepare(self, session_id, question):
+        # (запрос для поиска, история для prompt) перед ответом на вопрос сессии
+        with self._lock:
+            session = self._touch(session_id)
+            session.requests += 1
+            query = condense_question(question, session.topic)
+            if query != question:
+                self.condensed += 1
+            return query, self._history(session)
+
+    def _history(self, session):
+        # Снизу вверх: последние ходы, пока помещаются в бюджет, затем ранние вопросы
+        budget = self.history_tokens
+        lines = []
+        skipped = list(session.earlier)
+        for i, (question, answer) in enumerate(reversed(session.turns)):
+            turn = f"Пользователь: {question}\nПомощник: {answer}"
+            tokens = self.count_tokens(turn)
+            if tokens > budget:
+                skipped.extend(q for q, _ in session.turns[:len(session.turns) - i])
+                break
+            lines.insert(0, turn)
+            budget -= tokens
+        if skipped and budget > 0:
+            summary = "Ранее спрашивали: " + "; ".join(skipped[-self.max_earlier:])
+            lines.insert(0, truncate_tokens(summary, budget, self.count_tokens))
+        return "\n".join(lines)
+
+    def add_turn(self, session_id, question, answer):
+        with self._lock:
+            session = self._touch(session_id)
+            if not is_follow_up(question):
+                session.topic = question
+            session.turns.append((question, truncate_tokens(answer, self.answer_tokens, self.count_tokens)))
+            # Ходы сверх max_turns сжимаются до вопроса
+            while len(session.turns) > self.max_turns:
+                session.earlier.append(session.turns.pop(0)[0])
+            del session.earlier[:-self.max_earlier]
+            size = session.size()
+            self._bytes += size - session.bytes
+            session.bytes = size
+            # Переполнение — вытесняем самые давно активные сессии, кроме текущей
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._remove(oldest)
+                self.evicted_memory += 1
+
+    def drop(self, session_id):
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def session_stats(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return {
+                "session_id": session.id,
+                "turns": len(session.turns),
+                "earlier": len(session.earlier),
+                "requests": session.requests,
+                "bytes": session.bytes,
+                "history_tokens": self.count_tokens(self._history(session)) if session.turns else 0,
+                "idle_s": round(time.time() - session.last_seen, 1),
+                "age_s": round(time.time() - session.created_at, 1),
+            }
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle(time.time())
+            sizes = sorted(s.bytes for s in self._sessions.values())
+            return {
+                "sessions": len(sizes),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "bytes_avg": round(sum(sizes) / len(sizes)) if sizes else 0,
+                "bytes_p95": sizes[int(0.95 * (len(sizes) - 1))] if sizes else 0,
+                "bytes_max": sizes[-1] if sizes else 0,
+                "idle_ttl": self.idle_ttl,
+                "history_tokens": self.history_tokens,
+                "created": self.created,
+                "condensed": self.condensed,
+                "evicted_idle": self.evicted_idle,
+                "evicted_memory": self.evicted_memory,
+            }
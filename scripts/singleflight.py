@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+
+class _Flight:
+    # Одно вычисление в полёте: токены буферизуются, и каждый подписчик
+    # получает весь поток с начала, даже если подключился позже.
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.abandoned = False
+        self._changed = asyncio.Condition()
+
+    async def run(self):
+        try:
+            async for token in self.source:
+                self.tokens.append(token)
+                async with self._changed:
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("Генерация отменена")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        i = 0
+        try:
+            while True:
+                while i < len(self.tokens):
+                    yield self.tokens[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                async with self._changed:
+                    if i == len(self.tokens) and not self.done:
+                        await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # Все клиенты ушли — генерацию никто не ждёт
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    # Одинаковые одновременные запросы (по ключу) разделяют одно вычисление.
+    # Работает только внутри event loop, поэтому блокировки не нужны.
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    def subscribe(self, key, source_fn):
+        flight = self._flights.get(key)
+        if flight is None or flight.abandoned:
+            # source_fn может поднять QueueFullError — тогда полёт не создаётся
+            flight = _Flight(source_fn())
+            flight.task = asyncio.create_task(flight.run())
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+            self._flights[key] = flight
+            self.started += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        return flight.subscribe()
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(f.subscribers for f in self._flights.values()),
+            "started": self.started,
+            "coalesced": self.joined,
+        }
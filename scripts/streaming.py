@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+
+_ITEM, _ERROR, _DONE = range(3)
+
+
+def pool_stream(pool, gen_fn, *args):
+    # Запускает синхронный генератор в пуле и отдаёт его элементы
+    # как async-итератор. QueueFullError поднимается сразу, до старта потока.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(kind, value):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+        except RuntimeError:
+            # event loop уже закрыт
+            cancelled.set()
+
+    def produce():
+        try:
+            for item in gen_fn(*args):
+                if cancelled.is_set():
+                    break
+                put(_ITEM, item)
+        except Exception as e:
+            put(_ERROR, e)
+        finally:
+            put(_DONE, None)
+
+    pool.submit(produce)
+
+    async def consume():
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            # Клиент отключился или поток дочитан — генерацию можно прекращать
+            cancelled.set()
+
+    return consume()
+
+
+def sse_event(event, data):
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -9,6 +9,9 @@ from langchain_community.llms import Ollama
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 
+from index_store import resolve_index_path
+from query_embed_cache import cached_embeddings
+
 # Вопросы и ключевые слова
 test_questions = [
     {"query": "Где найти часто задаваемые вопросы по системе?", "keywords": ["Часто задаваемые вопросы", "ссылка", "значок", "ответ"]},
@@ -38,8 +41,8 @@ prompt_template = PromptTemplate(
 )
 
 # Модель и цепочка
-embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-db = FAISS.load_local("../faiss_index", embedding, allow_dangerous_deserialization=True)
+embedding = cached_embeddings(HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"))
+db = FAISS.load_local(resolve_index_path("../faiss_index"), embedding, allow_dangerous_deserialization=True)
 retriever = db.as_retriever(search_kwargs={"k": 2})
 llm = Ollama(model="mistral", temperature=0)
 
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import logging
+
+logger = logging.getLogger("uniguide.tokens")
+
+# Токенизатор LLM для бюджета контекста. Репозиторий mistralai закрытый: нужны принятые
+# условия на Hugging Face и токен (HF_TOKEN), иначе используется оценка approx_tokens
+DEFAULT_LLM_TOKENIZER = "mistralai/Mistral-7B-Instruct-v0.2"
+
+
+def approx_tokens(text):
+    # Грубая оценка для русского текста: ~3 символа на токен
+    return max(1, len(text) // 3)
+
+
+def llm_token_counter(tokenizer_name):
+    # Счётчик токенов токенизатором LLM; без transformers или без доступа к модели —
+    # грубая оценка approx_tokens (вызывающий код может это проверить: counter is approx_tokens)
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        logger.warning("Токенизатор %s недоступен, оценка по символам: %s", tokenizer_name, e)
+        return approx_tokens
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Сервер перегружен, повторите запрос позже")
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    # Пул потоков для блокирующей работы (embedding, FAISS, Ollama)
+    # с ограниченной очередью перед ним: лишние запросы отклоняются сразу.
+
+    def __init__(self, max_workers=2, max_queue=16, name="rag-worker"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        # Последние значения ожидания в очереди и времени выполнения (сек)
+        self._waits = deque(maxlen=512)
+        self._service = deque(maxlen=512)
+
+    def _admit(self):
+        with self._lock:
+            if self._queued + self._running >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self._retry_after())
+            self._queued += 1
+
+    def _retry_after(self):
+        # Оценка: сколько секунд нужно, чтобы разгрести текущую очередь
+        avg = sum(self._service) / len(self._service) if self._service else 1.0
+        backlog = (self._queued + self._running) / max(self.max_workers, 1)
+        return max(1, math.ceil(avg * backlog))
+
+    def _wrap(self, fn, args, kwargs, enqueued_at):
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits.append(started - enqueued_at)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._service.append(time.perf_counter() - started)
+
+    def submit(self, fn, *args, **kwargs):
+        self._admit()
+        return self._executor.submit(self._wrap, fn, args, kwargs, time.perf_counter())
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            service = list(self._service)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+                "service_ms_avg": round(1000 * sum(service) / len(service), 1) if service else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)